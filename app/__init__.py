@@ -9,6 +9,8 @@ __license__ = 'All Rights Reserved'
 __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
+import logging
+
 from flask import Flask, g, request, session, render_template
 from datetime import datetime
 
@@ -22,7 +24,75 @@ from app.lib.db import DB
 db = DB(app.config.get('DB_HOST'),
         app.config.get('DB_USER'),
         app.config.get('DB_PWD'),
-        app.config.get('DB_NAME'))
+        app.config.get('DB_NAME'),
+        port=app.config.get('DB_PORT', 3306),
+        pool_size=app.config.get('DB_POOL_SIZE', 5),
+        max_overflow=app.config.get('DB_POOL_MAX_OVERFLOW', 5),
+        pool_timeout=app.config.get('DB_POOL_TIMEOUT', 10),
+        recycle=app.config.get('DB_POOL_RECYCLE', 3600),
+        idle_timeout=app.config.get('DB_POOL_IDLE_TIMEOUT', 300),
+        ping_interval=app.config.get('DB_POOL_PING_INTERVAL', 30),
+        replicas=app.config.get('DB_REPLICAS'),
+        replica_strategy=app.config.get('DB_REPLICA_STRATEGY', 'round_robin'),
+        max_lag=app.config.get('DB_REPLICA_MAX_LAG', 5),
+        check_interval=app.config.get('DB_REPLICA_CHECK_INTERVAL', 10))
+
+from app.lib.query_log import QueryLog
+
+query_log = None
+if app.config.get('QUERY_LOG', True):
+    query_log = QueryLog(app.config.get('SLOW_QUERY_MS', 200),
+                         app.config.get('N_PLUS_ONE', 10), app.logger)
+    if app.config.get('SLOW_QUERY_LOG'):
+        query_log.logger = logging.getLogger('app.queries')
+        query_log.logger.addHandler(
+            logging.FileHandler(app.config['SLOW_QUERY_LOG']))
+    db.hooks.append(query_log)
+
+from app.lib.cache import make_cache
+from app.lib.query_cache import QueryCache, TableVersions
+
+query_cache = None
+if app.config.get('QUERY_CACHE'):
+    query_cache = QueryCache(
+        db, make_cache(app.config.get('QUERY_CACHE'),
+                       app.config.get('QUERY_CACHE_SIZE', 32 * 1024 * 1024),
+                       app.config.get('QUERY_CACHE_DIR'),
+                       app.config.get('QUERY_CACHE_TTL')),
+        TableVersions(app.config.get('QUERY_CACHE_VERSIONS')))
+    db.hooks.append(query_cache)
+
+from app.lib.diff_render import DiffRenderer
+
+diff_renderer = DiffRenderer(
+    make_cache(app.config.get('DIFF_CACHE'),
+               app.config.get('DIFF_CACHE_SIZE', 64 * 1024 * 1024),
+               app.config.get('DIFF_CACHE_DIR')),
+    app.config.get('DIFF_STYLE', 'colorful'))
+
+from app.lib.passwords import PasswordHasher
+
+passwords = PasswordHasher(app.config.get('PASSWORD_ALGORITHM', 'scrypt'),
+                           app.config.get('PASSWORD_PARAMS'),
+                           app.config.get('SALT', ''),
+                           app.config.get('PASSWORD_WORKERS', 2),
+                           app.config.get('PASSWORD_MAX_PENDING', 8),
+                           app.config.get('PASSWORD_TIMEOUT', 10),
+                           app.config.get('PASSWORD_SLOTS_DIR'))
+
+user_cache = make_cache(app.config.get('USER_CACHE'),
+                        app.config.get('USER_CACHE_SIZE', 10000),
+                        app.config.get('USER_CACHE_DIR'),
+                        app.config.get('USER_CACHE_TTL', 30))
+
+from app.lib.metrics import Metrics, instrument
+
+metrics = None
+if app.config.get('METRICS'):
+    metrics = Metrics(app.config.get('METRICS_DIR'))
+    instrument(app, metrics, db, diff_renderer,
+               {'diff': diff_renderer.cache, 'user': user_cache,
+                'query': query_cache})
 
 from app.routes import routes
 from app.models.users import Users
@@ -32,11 +102,34 @@ from app.models.users import Users
 def before_request():
     """Initialize globals before processing the request."""
     g.user = None
+    if query_log is not None:
+        query_log.begin(request.endpoint)
     # Checking of non static file is requested
     if '/static/' not in request.path:
         # initializing user id user_id is in session
         if 'user_id' in session:
             g.user = Users().get_user_by_id(session['user_id'])
+            if g.user is None:
+                # the user does not exist anymore
+                del session['user_id']
+
+
+@app.after_request
+def server_timing(response):
+    """Report the database time of the request."""
+    stats = query_log.current if query_log is not None else None
+    if stats is not None:
+        response.headers.add('Server-Timing', stats.server_timing(
+            query_log.n_plus_one))
+    return response
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    """Return the connection checked out by the request to the pool."""
+    db.release()
+    if query_log is not None:
+        query_log.end()
 
 
 @app.context_processor
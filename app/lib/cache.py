@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+"""Pluggable cache backends."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any
+
+
+class Cache(object):
+    """ Interface of the cache backends
+
+    Any object with the same get/set/delete methods (e.g. a thin wrapper
+    around a memcached or redis client) can be used as a backend.
+
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        super().__init__()
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """ Hit/miss counters of the cache
+
+        Returns
+        -------
+        dict
+
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class LRUCache(Cache):
+    """ In-process LRU cache bounded by the total size of the values
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum total size; str/bytes values weigh their length, anything
+        else weighs 1
+    ttl : float
+        Seconds an entry stays valid, None for no expiry
+
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    @staticmethod
+    def _weight(value: Any) -> int:
+        if isinstance(value, (str, bytes)):
+            return max(len(value), 1)
+        return 1
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, weight, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.size -= weight
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any):
+        weight = self._weight(value)
+        if weight > self.max_size:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (value, weight, expires)
+            self.size += weight
+            while self.size > self.max_size:
+                _, (_, evicted, _) = self._data.popitem(last=False)
+                self.size -= evicted
+
+    def delete(self, key: str):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        res = super().stats()
+        res.update({'size': self.size, 'entries': len(self._data)})
+        return res
+
+
+class FileCache(Cache):
+    """ Cache storing pickled values as files in a directory
+
+    The directory can be shared by all uWSGI workers of a host.
+
+    Parameters
+    ----------
+    directory : str
+    ttl : float
+        Seconds an entry stays valid, None for no expiry
+
+    """
+
+    def __init__(self, directory: str, ttl: float = None):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+        super().__init__()
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                self.misses += 1
+                return None
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file first so readers never see partial entries
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
+class TieredCache(Cache):
+    """ Local cache in front of a slower, shared one
+
+    Parameters
+    ----------
+    local : Cache
+    shared : Cache
+
+    """
+
+    def __init__(self, local: Cache, shared: Cache):
+        self.local = local
+        self.shared = shared
+
+        super().__init__()
+
+    def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        self.local.set(key, value)
+        self.shared.set(key, value)
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+
+def make_cache(kind: str, size: int = 1024, directory: str = None,
+               ttl: float = None) -> Cache:
+    """ Build a cache backend by its configured name
+
+    Parameters
+    ----------
+    kind : str
+        "memory", "disk", "tiered" (memory in front of disk) or None
+    size : int
+        Size bound of the in-process tier
+    directory : str
+        Directory of the on-disk tier
+    ttl : float
+
+    Returns
+    -------
+    Cache
+        None if caching is disabled
+
+    """
+    if not kind:
+        return None
+    if kind == 'memory':
+        return LRUCache(size, ttl)
+    if kind == 'disk':
+        return FileCache(directory, ttl)
+    if kind == 'tiered':
+        return TieredCache(LRUCache(size, ttl), FileCache(directory, ttl))
+    raise ValueError('Unknown cache backend {}'.format(kind))
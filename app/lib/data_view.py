@@ -10,9 +10,27 @@ __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
 import json
-from typing import Any, Iterable
-from app import db
-from psycopg2.extras import NamedTupleCursor
+import itertools
+from typing import Any, Iterable, Iterator
+from app import db, query_cache
+from app.lib.records import RecordCursor, SSRecordCursor
+from app.lib.query_log import TABLE_MODELS
+from app.lib.schema import MODELS, Schema
+
+# compiled statements keyed by model class and the shape of the call
+_PLANS = {}
+_PLANS_LIMIT = 4096
+
+
+def _rows_of(batches: Iterator[list]) -> Iterator[dict]:
+    """ Flatten the batches, closing them together with the generator
+
+    """
+    try:
+        for batch in batches:
+            yield from batch
+    finally:
+        batches.close()
 
 
 class DataView:
@@ -20,15 +38,64 @@ class DataView:
 
     """
 
-    def __init__(self):
-        self.link = db
-        self.joins = []
-        self.join_fields = []
-        self.result = None
+    # declared by the models; turned into the read-only schema (and
+    # fields/attr_list views of it) when the class is defined
+    table_name = None
+    fields = None
+    primary_key = None
+    relations = None
+    schema = None
+    attr_list = ()
+
+    link = db
+    # per-query state; instances replace these, never mutate them
+    joins = ()
+    join_fields = ()
+    result = None
+
+    # return rows as slot-based records instead of dicts (see compact)
+    compact_rows = False
+
+    # serve the reads of the model from the query cache (see cached)
+    cache_results = False
+    query_cache = query_cache
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        declared = ('table_name', 'fields', 'primary_key', 'relations')
+        if cls.fields is None or not any(key in cls.__dict__
+                                         for key in declared):
+            return
+        cls.schema = Schema(cls.table_name, cls.fields, cls.primary_key,
+                            cls.relations)
+        cls.fields = cls.schema.fields
+        cls.attr_list = cls.schema.attr_list
+        MODELS[cls.__name__] = cls
+        TABLE_MODELS[cls.table_name] = cls.__name__
+
+    def _plan(self, key: tuple, build) -> str:
+        """ Get the compiled SQL for the call shape, building it only once
 
-        self.update_fields()
+        Parameters
+        ----------
+        key : tuple
+            Shape of the call (statement type, columns, joins, where, ...)
+        build : callable
+            Returns the SQL string when it is not compiled yet
 
-        super().__init__()
+        Returns
+        -------
+        str
+
+        """
+        key = (self.schema,) + key
+        query = _PLANS.get(key)
+        if query is None:
+            if len(_PLANS) >= _PLANS_LIMIT:
+                # where clauses with inlined values would grow it forever
+                _PLANS.clear()
+            query = _PLANS[key] = build()
+        return query
 
     def column_name(self, key: str) -> str:
         """ Generate full column name (with alias if specified)
@@ -43,10 +110,7 @@ class DataView:
         str
 
         """
-        if "alias" in self.fields[key]:
-            return "{}.{} AS {}".format(self.table_name, key,
-                                        self.fields[key]["alias"])
-        return "{}.{}".format(self.table_name, key)
+        return self.schema.column_name(key)
 
     def __encode_objects(self, key: str, value) -> str:
         """ Encode field flagged by "json"
@@ -66,7 +130,7 @@ class DataView:
         """
         # two ways from here: either json dumps you, either you're going back
         # with empty hands
-        if self.fields[key].get('json', False) is True:
+        if key in self.schema.json:
             return json.dumps(value, default=self.__date_handler)
         return value
 
@@ -101,15 +165,63 @@ class DataView:
             Join type eg.: LEFT, RIGHT, INNER
 
         """
-        self.joins.append(" ".join((jtype.upper(), "JOIN", table, "ON", on)))
-        self.join_fields.extend(fields)
+        self.joins += (" ".join((jtype.upper(), "JOIN", table, "ON", on)),)
+        self.join_fields += tuple(fields)
 
     def clear_joins(self):
         """ Remove all previously specified joins
 
         """
-        self.joins = []
-        self.join_fields = []
+        self.joins = ()
+        self.join_fields = ()
+
+    def compact(self, enabled: bool = True) -> 'DataView':
+        """ Switch the selects of this instance to compact rows
+
+        Rows are then built as Record objects (__slots__ instead of a
+        dict per row), which support the same row['x'] / row.get('x')
+        access plus attributes and take a fraction of the memory. Meant
+        for list pages and exports with many rows.
+
+        Parameters
+        ----------
+        enabled : bool
+
+        Returns
+        -------
+        DataView
+            self, for chaining
+
+        """
+        self.compact_rows = enabled
+        return self
+
+    def cached(self, enabled: bool = True) -> 'DataView':
+        """ Switch the reads (select, count) of this instance to the cache
+
+        Results are kept by the query cache of the application until a
+        table they read is written, which makes it a fit for rows that
+        are read on every page but rarely change. Locking reads and reads
+        after the request wrote anything always go to the database.
+
+        Parameters
+        ----------
+        enabled : bool
+
+        Returns
+        -------
+        DataView
+            self, for chaining
+
+        """
+        self.cache_results = enabled
+        return self
+
+    def _read(self, query: str, values: dict, cursor: type = None):
+        """ Run a SELECT, through the query cache if enabled """
+        if self.cache_results and self.query_cache is not None:
+            return self.query_cache.fetch(query, values, cursor)
+        return self.link.execute(query, values, cursor, read_only=True)
 
     def clear(self):
         """ Clear SQL results
@@ -123,7 +235,7 @@ class DataView:
         """ Begin SQL transaction
 
         """
-        self.link.transaction = True
+        self.link.begin()
 
     def commit(self):
         """ Commit previously begun SQL transaction
@@ -145,42 +257,80 @@ class DataView:
 
     def select(self, where: str = '', values: dict = {}, group_by: str = '',
                order_by: str = '', limit: int = -1, offset: int = -1,
-               count: bool = False, lock: bool = False) -> Iterable:
+               count: bool = False, lock: bool = False,
+               columns: Iterable = None) -> Iterable:
         """ Wrapper for SQL SELECT statement
+
+        Fields flagged as "deferred" are only selected when named in
+        columns; columns='*' selects every field of the model.
+        """
+        query, values = self._select_query(where, values, group_by, order_by,
+                                           limit, offset, count, lock,
+                                           columns)
+        cursor = RecordCursor if self.compact_rows else None
+        if lock:
+            # locking reads belong to a transaction on the primary
+            self.result = self.link.execute(query, values, cursor)
+        else:
+            self.result = self._read(query, values, cursor)
+        return self.result
+
+    def _select_query(self, where: str = '', values: dict = {},
+                      group_by: str = '', order_by: str = '', limit: int = -1,
+                      offset: int = -1, count: bool = False,
+                      lock: bool = False, columns: Iterable = None) -> tuple:
+        """ Compile the SELECT statement and its arguments
+
         """
-        query_tail = []
-        if len(group_by) > 0:
-            query_tail.append('GROUP BY %s' % group_by)
-        if len(order_by) > 0:
-            query_tail.append('ORDER BY %s' % order_by)
+        if limit > 0 or offset > 0:
+            values = dict(values)
         if limit > 0:
-            query_tail.append('LIMIT %(limit)s')
             values['limit'] = limit
         if offset > 0:
-            query_tail.append('OFFSET %(offset)s')
             values['offset'] = offset
-        if lock is True:
-            query_tail.append('FOR UPDATE')
-        if len(where) == 0:
-            where = True
 
-        fields = self.attr_list + self.join_fields
-
-        if count:
-            fields += ['count(*) OVER () as all_count']
-
-        query = self.link.select % (", ".join(fields), self.table_name,
-                                    " ".join(self.joins),
-                                    where, " ".join(query_tail))
-
-        self.result = self.link.execute(query, values)
-        return self.result
+        if columns is None:
+            attrs = self.attr_list
+        else:
+            attrs = self.schema.columns if columns == '*' else tuple(columns)
+
+        key = ('select', attrs, self.join_fields, self.joins, where,
+               group_by, order_by, limit > 0, offset > 0, count, lock)
+
+        def build():
+            query_tail = []
+            if len(group_by) > 0:
+                query_tail.append('GROUP BY %s' % group_by)
+            if len(order_by) > 0:
+                query_tail.append('ORDER BY %s' % order_by)
+            if limit > 0:
+                query_tail.append('LIMIT %(limit)s')
+            if offset > 0:
+                query_tail.append('OFFSET %(offset)s')
+            if lock is True:
+                query_tail.append('FOR UPDATE')
+
+            if columns is None:
+                fields = list(self.attr_list)
+            else:
+                fields = list(map(self.column_name, attrs))
+            fields += self.join_fields
+            if count:
+                fields += ['count(*) OVER () as all_count']
+
+            return self.link.select % (", ".join(fields), self.table_name,
+                                       " ".join(self.joins),
+                                       where if len(where) > 0 else True,
+                                       " ".join(query_tail))
+
+        return self._plan(key, build), values
 
     def find(self, where: str = '', values: dict = {}, order_by: str = '',
-             lock: bool = False) -> object:
+             lock: bool = False, columns: Iterable = None) -> object:
         """ Selects only one row with specified conditions
         """
-        res = self.select(where, values, '', order_by, 1, lock=lock).fetchone()
+        res = self.select(where, values, '', order_by, 1, lock=lock,
+                          columns=columns).fetchone()
         self.clear()
         return res
 
@@ -189,19 +339,19 @@ class DataView:
         """
         values = {key: self.__encode_objects(key, values[key])
                   for key in values if key in self.fields}
-        field_list = {key: "%%(%s)s" % key
-                      for key in values if key in self.fields and
-                      self.fields[key].get("rdonly", False) is False}
+        columns = tuple(key for key in values
+                        if key not in self.schema.rdonly)
 
-        query_tail = ''
-        if len(field_list) == 0:
+        if len(columns) == 0:
             return False
 
-        query = self.link.insert % \
-                (self.table_name, ", ".join(field_list.keys()),
-                 ", ".join(field_list.values()), query_tail)
+        def build():
+            return self.link.insert % \
+                   (self.table_name, ", ".join(columns),
+                    ", ".join("%%(%s)s" % key for key in columns), '')
 
-        self.result = self.link.execute(query, values)
+        self.result = self.link.execute(self._plan(('insert', columns), build),
+                                        values)
         if self.result is None or self.result.rowcount != 1:
             return False
 
@@ -211,26 +361,116 @@ class DataView:
 
         return res
 
+    def insert_many(self, rows: Iterable, chunk_size: int = 1000) -> int:
+        """ Wrapper for multi-row SQL INSERT statement
+
+        Parameters
+        ----------
+        rows : Iterable
+            Dicts sharing the same set of keys
+        chunk_size : int
+            Number of rows sent per executemany call
+
+        Returns
+        -------
+        int
+            Number of affected rows
+
+        """
+        return self._insert_rows(rows, (), chunk_size)
+
+    def upsert_many(self, rows: Iterable, conflict_keys: Iterable,
+                    chunk_size: int = 1000) -> int:
+        """ Wrapper for multi-row INSERT ... ON DUPLICATE KEY UPDATE
+
+        Parameters
+        ----------
+        rows : Iterable
+            Dicts sharing the same set of keys
+        conflict_keys : Iterable
+            Columns of the unique key, these are never updated
+        chunk_size : int
+            Number of rows sent per executemany call
+
+        Returns
+        -------
+        int
+            Number of affected rows (MySQL counts updated rows twice)
+
+        """
+        return self._insert_rows(rows, tuple(conflict_keys), chunk_size,
+                                 upsert=True)
+
+    def _insert_rows(self, rows: Iterable, conflict_keys: tuple,
+                     chunk_size: int, upsert: bool = False) -> int:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+
+        columns = [key for key in first if key in self.fields and
+                   key not in self.schema.rdonly]
+        if len(columns) == 0:
+            return 0
+
+        query_tail = ''
+        if upsert:
+            updates = ["{0}=VALUES({0})".format(key) for key in columns
+                       if key not in conflict_keys]
+            if len(updates) == 0:
+                # nothing to update, keep the existing rows untouched
+                updates = ["{0}={0}".format(columns[0])]
+            query_tail = 'ON DUPLICATE KEY UPDATE ' + ', '.join(updates)
+
+        query = self._plan(
+            ('insert', tuple(columns), conflict_keys if upsert else None),
+            lambda: self.link.insert % (
+                self.table_name, ", ".join(columns),
+                ", ".join("%%(%s)s" % key for key in columns), query_tail))
+
+        count = 0
+        chunk = []
+        for row in itertools.chain((first,), rows):
+            if any(key not in row for key in columns):
+                self.throw('insert_many rows must share the same keys')
+            chunk.append({key: self.__encode_objects(key, row[key])
+                          for key in columns})
+            if len(chunk) >= chunk_size:
+                count += self._execute_chunk(query, chunk)
+                chunk = []
+        if chunk:
+            count += self._execute_chunk(query, chunk)
+        return count
+
+    def _execute_chunk(self, query: str, chunk: list) -> int:
+        self.result = self.link.executemany(query, chunk)
+        count = self.result.rowcount
+        self.clear()
+        return count
+
     def update(self, values: dict, where=True, condition: dict = {}) -> Any:
         """ Wrapper for SQL UPDATE statement
         """
         values = {key: self.__encode_objects(key, values[key])
                   for key in values if key in self.fields}
-        field_list = ["%s=%%(%s)s" % (key, key)
-                      for key in values if key in self.fields and
-                      self.fields[key].get("rdonly", False) is False]
+        columns = tuple(key for key in values
+                        if key not in self.schema.rdonly)
 
-        if len(field_list) == 0:
+        if len(columns) == 0:
             return False
 
         query_tail = ''
-        
+
         values = dict(list(values.items()) + list(condition.items()))
 
-        query = self.link.update % \
-                (self.table_name, ", ".join(field_list), where, query_tail)
+        def build():
+            return self.link.update % \
+                   (self.table_name,
+                    ", ".join("%s=%%(%s)s" % (key, key) for key in columns),
+                    where, query_tail)
 
-        self.result = self.link.execute(query, values)
+        self.result = self.link.execute(
+            self._plan(('update', columns, where), build), values)
 
         # if no rows affected return false
         if self.result is None or self.result.rowcount < 1:
@@ -249,7 +489,8 @@ class DataView:
     def delete(self, where=True, values: dict = {}) -> int:
         """ Wrapper for SQL UPDATE statement
         """
-        query = self.link.delete % (self.table_name, where)
+        query = self._plan(('delete', where),
+                           lambda: self.link.delete % (self.table_name, where))
 
         self.result = self.link.execute(query, values)
         if self.result is None or self.result.rowcount == 0:
@@ -259,15 +500,83 @@ class DataView:
         self.clear()
         return count
 
+    def count(self, where: str = '', values: dict = {}) -> int:
+        """ Count the records matching the conditions
+
+        Parameters
+        ----------
+        where : str
+        values : dict
+
+        Returns
+        -------
+        int
+
+        """
+        query = self._plan(
+            ('count', self.joins, where),
+            lambda: self.link.select % ('COUNT(*) AS count', self.table_name,
+                                        " ".join(self.joins),
+                                        where if len(where) > 0 else True, ''))
+
+        self.result = self._read(query, values)
+        res = self.result.fetchone()
+        self.clear()
+        return res['count'] if res else 0
+
     def all(self, where: str = '', values: dict = {}, group_by: str = '',
-            order_by: str = '', limit: int = -1, offset: int = -1) -> object:
+            order_by: str = '', limit: int = -1, offset: int = -1,
+            columns: Iterable = None) -> object:
         """ Select all records
         """
         result = self.select(where, values, group_by, order_by, limit,
-                             offset).fetchall()
+                             offset, columns=columns).fetchall()
         self.clear()
         return result
 
+    def stream(self, where: str = '', values: dict = {}, group_by: str = '',
+               order_by: str = '', limit: int = -1, columns: Iterable = None,
+               batch_size: int = 1000) -> Iterator[list]:
+        """ Select records lazily, in batches
+
+        The rows are fetched with a server-side cursor on a connection of
+        their own, so memory use does not depend on the size of the result.
+        Uncommitted changes of the current transaction are not visible.
+
+        Parameters
+        ----------
+        where : str
+        values : dict
+        group_by : str
+        order_by : str
+        limit : int
+        columns : Iterable
+        batch_size : int
+            Rows per batch
+
+        Returns
+        -------
+        Iterator[list]
+
+        """
+        query, values = self._select_query(where, values, group_by, order_by,
+                                           limit, columns=columns)
+        if self.compact_rows:
+            return self.link.stream(query, values, batch_size, SSRecordCursor,
+                                    read_only=True)
+        return self.link.stream(query, values, batch_size, read_only=True)
+
+    def iter_rows(self, where: str = '', values: dict = {},
+                  group_by: str = '', order_by: str = '', limit: int = -1,
+                  columns: Iterable = None,
+                  batch_size: int = 1000) -> Iterator[dict]:
+        """ Select records lazily, one row at a time (see stream)
+
+        """
+        batches = self.stream(where, values, group_by, order_by, limit,
+                              columns, batch_size)
+        return _rows_of(batches)
+
     def throw(self, message: str):
         """ Wrapper for Exception raising
         """
@@ -352,12 +661,20 @@ class DataView:
                 function_name,
                 ', '.join(arguments) if len(arguments) > 0 else ''))
 
-    def update_fields(self, fields=None):
-        if fields is not None:
-            self.fields = fields
+    def update_fields(self, fields: dict = None):
+        """ Use other fields for this instance only
+
+        The schema of the class is left untouched; the instance gets one
+        of its own.
+
+        Parameters
+        ----------
+        fields : dict
 
-        # set default options to the fields if options are None
-        for key in self.fields:
-            if self.fields[key] is None:
-                self.fields[key] = {}
-        self.attr_list = list(map(self.column_name, self.fields))
+        """
+        if fields is None:
+            return
+        self.schema = Schema(self.table_name, fields, self.primary_key,
+                             self.relations)
+        self.fields = self.schema.fields
+        self.attr_list = self.schema.attr_list
@@ -9,8 +9,42 @@ __license__ = 'All Rights Reserved'
 __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
+import os
+import time
+import threading
+import itertools
+from contextlib import contextmanager
+from functools import wraps
+from typing import Iterator
+
 import pymysql.cursors
 
+from app.lib.pool import Pool
+
+
+class Replica(object):
+    """ Read replica with its own pool and last known health
+
+    Parameters
+    ----------
+    host : str
+    port : int
+    pool : Pool
+
+    """
+
+    def __init__(self, host: str, port: int, pool: Pool):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.healthy = True
+        self.lag = None
+        # Threads_connected of the server at the last check (all clients)
+        self.connections = None
+        self.checked = None
+
+        super().__init__()
+
 
 class DB(object):
 
@@ -20,63 +54,448 @@ class DB(object):
     select_count = "SELECT SUM(src.count) AS count FROM (%s) AS src"
     delete = "DELETE FROM %s WHERE %s"
 
-    def __init__(self, host: str, user: str, pwd: str, dbname: str):
+    def __init__(self, host: str, user: str, pwd: str, dbname: str,
+                 port: int = 3306, pool_size: int = 5, max_overflow: int = 5,
+                 pool_timeout: float = 10.0, recycle: float = 3600,
+                 idle_timeout: float = 300, ping_interval: float = 30,
+                 replicas: list = None, replica_strategy: str = 'round_robin',
+                 max_lag: float = 5, check_interval: float = 10):
         self.host = host
         self.user = user
         self.pwd = pwd
         self.dbname = dbname
-        self.transaction = False
-        self.conn = pymysql.connect(
-            host=self.host,
+        self.port = int(port)
+        pool_args = dict(size=pool_size, max_overflow=max_overflow,
+                         timeout=pool_timeout, recycle=recycle,
+                         idle_timeout=idle_timeout,
+                         ping_interval=ping_interval)
+        # connections are opened lazily, i.e. after uWSGI forked the workers
+        self.pool = Pool(self.connect, **pool_args)
+
+        # "host" or "host:port" of every read replica
+        self.replicas = []
+        for address in replicas or []:
+            r_host, _, r_port = str(address).partition(':')
+            r_port = int(r_port or self.port)
+            self.replicas.append(Replica(r_host, r_port, Pool(
+                lambda h=r_host, p=r_port: self.connect(h, p), **pool_args)))
+        if replica_strategy not in ('round_robin', 'least_connections'):
+            raise ValueError('Unknown replica strategy {}'.format(
+                replica_strategy))
+        self.replica_strategy = replica_strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next_replica = itertools.count()
+
+        # callables hook(query, duration, rows) run after every statement
+        self.hooks = []
+
+        self._local = threading.local()
+        self._max_packet = None
+
+        super().__init__()
+
+    def connect(self, host: str = None,
+                port: int = None) -> pymysql.connections.Connection:
+        """ Open a new connection to the DB (the primary by default)
+
+        """
+        return pymysql.connect(
+            host=host or self.host,
+            port=port or self.port,
             user=self.user,
             password=self.pwd,
             db=self.dbname,
             charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
+            cursorclass=pymysql.cursors.DictCursor,
+            # statements outside of a unit of work commit on the server
+            # without an extra COMMIT round trip
+            autocommit=True
         )
 
-        super().__init__()
+    @property
+    def conn(self) -> pymysql.connections.Connection:
+        """ Connection checked out for the current thread (request)
+
+        """
+        item = getattr(self._local, 'item', None)
+        if item is None or item.pid != os.getpid():
+            item = self._local.item = self.pool.acquire()
+        return item.conn
+
+    def release(self, discard: bool = False):
+        """ Give the connection of the current thread back to the pool
+
+        Parameters
+        ----------
+        discard : bool
+            Close the connection instead of reusing it
+
+        """
+        self._release_replica(discard)
+        self._local.wrote = False
+        item = getattr(self._local, 'item', None)
+        if item is None:
+            return
+        self._local.item = None
+        if self.transaction and not discard:
+            # never hand over a connection with a dangling transaction
+            try:
+                item.conn.rollback()
+            except Exception:
+                discard = True
+        self._local.depth = 0
+        self._local.callbacks = []
+        self.pool.release(item, discard)
+
+    def _release_replica(self, discard: bool = False):
+        held = getattr(self._local, 'replica', None)
+        if held is not None:
+            self._local.replica = None
+            held[0].pool.release(held[1], discard)
 
     def reconnect(self):
         """ Close the current connection and reconnect to the DB
 
         """
-        self.conn.close()
-        self.conn = pymysql.connect(
-            host=self.host,
-            user=self.user,
-            password=self.pwd,
-            db=self.dbname,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
+        self.release(discard=True)
+        return self.conn
+
+    @property
+    def transaction(self) -> bool:
+        """ Whether the current thread has an open transaction
+
+        """
+        return getattr(self._local, 'depth', 0) > 0
+
+    @property
+    def dirty(self) -> bool:
+        """ Whether the current thread (request) changed anything since its
+        connection was checked out
+
+        """
+        return getattr(self._local, 'wrote', False)
+
+    @staticmethod
+    def _lost(ex: Exception) -> bool:
+        """ Whether the error means the connection is gone
+
+        """
+        # client side errors (2xxx) are raised when the server is unreachable
+        return isinstance(ex, pymysql.err.InterfaceError) or (
+            isinstance(ex, pymysql.err.OperationalError) and
+            bool(ex.args) and ex.args[0] >= 2000)
+
+    def _replica_allowed(self) -> bool:
+        """ Whether reads of the current thread may go to a replica
+
+        Reads stay on the primary inside a transaction and, to read the
+        own writes, for the rest of a request that changed anything.
+
+        """
+        return bool(self.replicas) and not self.transaction and \
+            not self.dirty
+
+    def _check(self, replica: Replica) -> bool:
+        """ Refresh the health of the replica every check_interval seconds
+
+        A replica is used while it is reachable and its replication lag is
+        at most max_lag. When the replication status cannot be read (no
+        privilege, or the server is not a replica) only reachability
+        counts. The number of connected clients is read as well, for the
+        least_connections strategy.
+
+        """
+        now = time.monotonic()
+        if replica.checked is not None and \
+                now - replica.checked < self.check_interval:
+            return replica.healthy
+        replica.checked = now
+        try:
+            item = replica.pool.acquire()
+        except Exception:
+            replica.healthy = False
+            return False
+
+        row, lost = None, False
+        try:
+            cur = item.conn.cursor()
+            try:
+                cur.execute('SHOW REPLICA STATUS')
+            except pymysql.err.ProgrammingError:
+                # servers before MySQL 8.0.22
+                cur.execute('SHOW SLAVE STATUS')
+            row = cur.fetchone()
+            cur.execute("SHOW GLOBAL STATUS LIKE 'Threads_connected'")
+            status = cur.fetchone()
+            replica.connections = int(status['Value']) if status else None
+            cur.close()
+        except Exception as ex:
+            lost = self._lost(ex)
+        replica.pool.release(item, discard=lost)
+
+        if lost:
+            replica.healthy = False
+        elif row is None:
+            replica.lag = None
+            replica.healthy = True
+        else:
+            lag = row.get('Seconds_Behind_Source',
+                          row.get('Seconds_Behind_Master'))
+            # NULL lag means replication is not running
+            replica.lag = lag
+            replica.healthy = lag is not None and lag <= self.max_lag
+        return replica.healthy
+
+    def _pick_replica(self) -> Replica:
+        """ Healthy replica chosen by the configured strategy, if any
 
-    def execute(self, query: str, args: dict = {}) -> pymysql.cursors.DictCursor:
+        """
+        candidates = [r for r in self.replicas if self._check(r)]
+        if not candidates:
+            return None
+        start = next(self._next_replica) % len(candidates)
+        if self.replica_strategy == 'least_connections':
+            # the load of the server (all workers and clients) as of the
+            # last check plus the connections this process holds; ties
+            # (e.g. no figure yet) go round robin
+            rotated = candidates[start:] + candidates[:start]
+            return min(rotated, key=lambda r: (r.connections or 0) +
+                       r.pool.stats()['in_use'])
+        return candidates[start]
+
+    def _reader(self) -> tuple:
+        """ Replica and connection serving the reads of the current thread
+
+        The replica is kept for the whole request, so its reads see one
+        consistent state. None when the read has to go to the primary.
+
+        """
+        if not self._replica_allowed():
+            return None
+        held = getattr(self._local, 'replica', None)
+        if held is not None and held[0].healthy and \
+                held[1].pid == os.getpid():
+            return held
+        self._release_replica()
+        replica = self._pick_replica()
+        if replica is None:
+            return None
+        try:
+            item = replica.pool.acquire()
+        except Exception:
+            replica.healthy = False
+            return None
+        held = self._local.replica = (replica, item)
+        return held
+
+    def _run(self, cur: pymysql.cursors.Cursor, query: str, args,
+             many: bool = False):
+        """ Execute on the cursor, timing the statement for the hooks
+
+        """
+        run = cur.executemany if many else cur.execute
+        if not self.hooks:
+            return run(query, args)
+        start = time.perf_counter()
+        try:
+            return run(query, args)
+        finally:
+            duration = time.perf_counter() - start
+            for hook in self.hooks:
+                hook(query, duration, cur.rowcount)
+
+    def execute(self, query: str, args: dict = {}, cursor: type = None,
+                read_only: bool = False) -> pymysql.cursors.DictCursor:
         """ Execute the query
 
+        cursor overrides the cursor class (DictCursor by default).
+        read_only queries are sent to a replica when one is configured and
+        allowed (see _replica_allowed), falling back to the primary when
+        the replica is unreachable.
+
         """
+        held = self._reader() if read_only else None
+        if held is not None:
+            cur = held[1].conn.cursor(cursor)
+            try:
+                self._run(cur, query, args)
+                return cur
+            except pymysql.err.MySQLError as ex:
+                if not self._lost(ex):
+                    raise Exception(ex)
+                held[0].healthy = False
+                self._release_replica(discard=True)
+        elif not read_only and query.lstrip()[:6].upper() != 'SELECT':
+            self._local.wrote = True
 
-        if self.conn.open:
-            self.reconnect()
+        cur = self.conn.cursor(cursor)
 
+        try:
+            self._run(cur, query, args)
+        except (pymysql.err.OperationalError,
+                pymysql.err.InterfaceError) as ex:
+            if self._lost(ex):
+                self.release(discard=True)
+            raise Exception(ex)
+        except Exception as ex:
+            raise Exception(ex)
+        return cur
+
+    def executemany(self, query: str,
+                    args: list) -> pymysql.cursors.DictCursor:
+        """ Execute the query for every set of arguments
+
+        INSERT statements are sent as multi-row VALUES lists, split so that
+        no statement exceeds the server's max_allowed_packet.
+
+        """
+        self._local.wrote = True
         cur = self.conn.cursor()
+        cur.max_stmt_length = self.max_packet()
 
         try:
-            cur.execute(query, args)
-            if not self.transaction:
-                self.conn.commit()
+            self._run(cur, query, args, many=True)
+        except (pymysql.err.OperationalError,
+                pymysql.err.InterfaceError) as ex:
+            if self._lost(ex):
+                self.release(discard=True)
+            raise Exception(ex)
         except Exception as ex:
-            self.conn.rollback()
             raise Exception(ex)
         return cur
 
+    def stream(self, query: str, args: dict = {}, batch_size: int = 1000,
+               cursor: type = pymysql.cursors.SSDictCursor,
+               read_only: bool = False) -> Iterator[list]:
+        """ Execute the query with an unbuffered cursor, yielding batches
+
+        An unbuffered result blocks its connection until it is read to
+        the end, so a connection is checked out of the pool for the
+        lifetime of the generator instead of using the thread's one. Once
+        the result is exhausted the connection goes back to the pool; when
+        the generator is closed early it is discarded, since draining the
+        rest of the result can take longer than reconnecting.
+
+        Parameters
+        ----------
+        query : str
+        args : dict
+        batch_size : int
+            Rows fetched per round trip
+        cursor : type
+            Unbuffered cursor class
+        read_only : bool
+            Allow the query to run on a replica
+
+        Returns
+        -------
+        Iterator[list]
+
+        """
+        pool = self.pool
+        if read_only and self._replica_allowed():
+            replica = self._pick_replica()
+            if replica is not None:
+                pool = replica.pool
+        item = pool.acquire()
+        done = False
+        try:
+            cur = item.conn.cursor(cursor)
+            try:
+                self._run(cur, query, args)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            except (pymysql.err.MySQLError, ValueError) as ex:
+                raise Exception(ex)
+            cur.close()
+            done = True
+        finally:
+            pool.release(item, discard=not done)
+
+    def max_packet(self) -> int:
+        """ Usable statement size derived from max_allowed_packet
+
+        """
+        if self._max_packet is None:
+            cur = self.conn.cursor()
+            cur.execute('SELECT @@max_allowed_packet AS size')
+            # leave room for the packet header and escaping differences
+            self._max_packet = int(cur.fetchone()['size'] * 0.9)
+            cur.close()
+        return self._max_packet
+
+    def begin(self):
+        """ Begin a transaction on the connection of the current thread
+
+        Nested calls join the outermost transaction.
+
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self.conn.begin()
+        self._local.depth = depth + 1
+
     def commit(self):
         """ Commits the open transaction if any found """
-        if self.transaction:
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 1:
             self.conn.commit()
-            self.transaction = False
+        self._local.depth = max(depth - 1, 0)
+        if depth == 1:
+            callbacks = getattr(self._local, 'callbacks', [])
+            self._local.callbacks = []
+            for callback in callbacks:
+                callback()
 
     def rollback(self):
         """ Rallbacks current transaction """
-        self.conn.rollback()
-        self.transaction = False
+        if self.transaction:
+            self.conn.rollback()
+        self._local.depth = 0
+        self._local.callbacks = []
+
+    def on_commit(self, callback):
+        """ Run the callback once the current transaction is committed
+
+        Outside of a transaction the callback runs immediately, on rollback
+        it is dropped.
+
+        """
+        if not self.transaction:
+            callback()
+            return
+        if not getattr(self._local, 'callbacks', None):
+            self._local.callbacks = []
+        self._local.callbacks.append(callback)
+
+    @contextmanager
+    def unit_of_work(self):
+        """ Run the enclosed statements in a single transaction
+
+        Commits once on exit and rolls everything back on error.
+
+        """
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def transactional(self):
+        """ Wrap the function (route) into a unit of work """
+
+        def decor_w(f):
+            @wraps(f)
+            def decor_function(*args, **kwargs):
+                with self.unit_of_work():
+                    return f(*args, **kwargs)
+
+            return decor_function
+
+        return decor_w
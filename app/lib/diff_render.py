@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+
+"""Syntax highlighting of revision diffs."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import time
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+from markupsafe import escape
+from pygments import highlight
+from pygments.lexers import get_lexer_by_name
+from pygments.formatters import HtmlFormatter
+from pygments.styles import get_style_by_name
+
+from app.lib.cache import Cache
+
+FILE_HEADERS = ('diff ', 'Index: ')
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """ Split a stream of text chunks into lines (keeping line ends)
+
+    """
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).splitlines(True)
+        rest = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        yield from lines
+    if rest:
+        yield rest
+
+
+def iter_files(chunks: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """ Split a diff into the parts for every file
+
+    A file starts at a "diff ..." or "Index: ..." header, or at a
+    "--- "/"+++ " pair following a hunk of the previous file.
+
+    Parameters
+    ----------
+    chunks : Iterable[str]
+        The diff, possibly in pieces
+
+    Returns
+    -------
+    Iterator[Tuple[int, str]]
+        Character offset of the file in the diff and its text
+
+    """
+    lines = []
+    start = pos = 0
+    in_hunk = False
+    for line in iter_lines(chunks):
+        new_file = line.startswith(FILE_HEADERS)
+        if (not new_file and in_hunk and line.startswith('+++ ') and
+                lines and lines[-1].startswith('--- ')):
+            # the "--- " line already collected opens the next file
+            header = lines.pop()
+            if lines:
+                yield start, ''.join(lines)
+            start = pos - len(header)
+            lines = [header]
+            in_hunk = False
+        elif new_file and lines:
+            yield start, ''.join(lines)
+            start = pos
+            lines = []
+            in_hunk = False
+        if line.startswith('@@'):
+            in_hunk = True
+        lines.append(line)
+        pos += len(line)
+    if lines:
+        yield start, ''.join(lines)
+
+
+def file_path(text: str) -> str:
+    """ Best effort name of the file a diff part belongs to
+
+    """
+    for line in text.splitlines()[:10]:
+        if line.startswith('+++ ') and not line.startswith('+++ /dev/null'):
+            path = line[4:].split('\t')[0].strip()
+            return path[2:] if path.startswith('b/') else path
+        if line.startswith('--- ') and not line.startswith('--- /dev/null'):
+            path = line[4:].split('\t')[0].strip()
+            return path[2:] if path.startswith('a/') else path
+        if line.startswith('diff --git '):
+            path = line.split(' b/')[-1].strip()
+        elif line.startswith('Index: '):
+            path = line[7:].strip()
+        else:
+            continue
+        return path
+    return ''
+
+
+def file_stats(text: str) -> Tuple[str, int, int]:
+    """ Status and number of added and deleted lines of a diff part
+
+    Parameters
+    ----------
+    text : str
+        The diff of one file (see iter_files)
+
+    Returns
+    -------
+    Tuple[str, int, int]
+        "added", "deleted", "renamed", "binary" or "modified", additions,
+        deletions
+
+    """
+    status = 'modified'
+    additions = deletions = 0
+    in_hunk = False
+    for line in text.splitlines():
+        if in_hunk:
+            if line.startswith('+'):
+                additions += 1
+            elif line.startswith('-'):
+                deletions += 1
+            elif line.startswith('@@') or line[:1] in (' ', '\\', ''):
+                pass
+            else:
+                in_hunk = False
+        if in_hunk:
+            continue
+        if line.startswith('@@'):
+            in_hunk = True
+        elif line.startswith('new file mode') or line == '--- /dev/null' or \
+                line.startswith('--- /dev/null\t'):
+            status = 'added'
+        elif line.startswith('deleted file mode') or \
+                line == '+++ /dev/null' or line.startswith('+++ /dev/null\t'):
+            status = 'deleted'
+        elif line.startswith('rename from ') and status == 'modified':
+            status = 'renamed'
+        elif line.startswith('Binary files ') or line == 'GIT binary patch':
+            status = 'binary'
+    return status, additions, deletions
+
+
+def index_files(chunks: Iterable[str]) -> Iterator[dict]:
+    """ Per-file index of a diff: path, status, line counts and position
+
+    Parameters
+    ----------
+    chunks : Iterable[str]
+        The diff, possibly in pieces
+
+    Returns
+    -------
+    Iterator[dict]
+        file_no, path, status, additions, deletions, offset and length
+        (in characters, as SUBSTRING counts them) of every file
+
+    """
+    for file_no, (offset, text) in enumerate(iter_files(chunks)):
+        status, additions, deletions = file_stats(text)
+        yield {
+            'file_no': file_no,
+            'path': file_path(text)[:1024],
+            'status': status,
+            'additions': additions,
+            'deletions': deletions,
+            'offset': offset,
+            'length': len(text),
+        }
+
+
+class DiffRenderer(object):
+    """ Render diffs to HTML, caching the result per revision and style
+
+    Revisions are immutable once committed, so rendered diffs never need
+    to be invalidated.
+
+    Parameters
+    ----------
+    cache : Cache
+        Backend for the rendered HTML, None disables caching
+    style : str
+        Default Pygments style
+
+    """
+
+    def __init__(self, cache: Cache = None, style: str = 'colorful'):
+        self.cache = cache
+        self.style = style
+        self.lexer = get_lexer_by_name('diff', stripall=True)
+        self._formatters = {}
+        self._stylesheets = {}
+        # callables hook(duration, size) run after every highlighting
+        self.hooks = []
+        # computed once at startup instead of on every page view
+        self.stylesheet(style)
+
+        super().__init__()
+
+    def formatter(self, style: str = None) -> HtmlFormatter:
+        """ Get the (reusable) HTML formatter for the style
+
+        """
+        style = style or self.style
+        formatter = self._formatters.get(style)
+        if formatter is None:
+            formatter = self._formatters[style] = HtmlFormatter(
+                style=get_style_by_name(style))
+        return formatter
+
+    def stylesheet(self, style: str = None) -> str:
+        """ CSS definitions matching the rendered diffs
+
+        """
+        style = style or self.style
+        css = self._stylesheets.get(style)
+        if css is None:
+            css = self._stylesheets[style] = \
+                self.formatter(style).get_style_defs('.highlight')
+        return css
+
+    @staticmethod
+    def key(project_id: Any, revision_id: Any, style: str) -> str:
+        return 'diff:{}:{}:{}'.format(project_id, revision_id, style)
+
+    def highlight(self, diff: str, style: str = None) -> str:
+        """ Highlight the diff without touching the cache
+
+        """
+        if not self.hooks:
+            return highlight(diff or '', self.lexer, self.formatter(style))
+        start = time.perf_counter()
+        html = highlight(diff or '', self.lexer, self.formatter(style))
+        duration = time.perf_counter() - start
+        for hook in self.hooks:
+            hook(duration, len(diff or ''))
+        return html
+
+    def render(self, project_id: Any, revision_id: Any, load: Callable,
+               style: str = None) -> str:
+        """ Get the rendered diff of a revision
+
+        Parameters
+        ----------
+        project_id : Any
+        revision_id : Any
+        load : Callable
+            Returns the diff text, only called on a cache miss
+        style : str
+
+        Returns
+        -------
+        str
+
+        """
+        style = style or self.style
+        if self.cache is None:
+            return self.highlight(load(), style)
+
+        key = self.key(project_id, revision_id, style)
+        html = self.cache.get(key)
+        if html is None:
+            html = self.highlight(load(), style)
+            self.cache.set(key, html)
+        return html
+
+    def cached(self, project_id: Any, revision_id: Any,
+               style: str = None) -> str:
+        """ Get the rendered diff if it is already in the cache
+
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get(self.key(project_id, revision_id,
+                                       style or self.style))
+
+    def stream(self, chunks: Iterable[str], fragment_url: Callable,
+               cutoff: int, style: str = None) -> Iterator[str]:
+        """ Render a large diff file by file
+
+        Files bigger than cutoff are replaced by a link to load them on
+        demand, so neither the whole diff nor its HTML is held in memory.
+
+        Parameters
+        ----------
+        chunks : Iterable[str]
+            The diff, in pieces
+        fragment_url : Callable
+            Returns the URL rendering the file with the given number
+        cutoff : int
+            Size (characters) above which a file is collapsed
+        style : str
+
+        Returns
+        -------
+        Iterator[str]
+
+        """
+        for file_no, (_, text) in enumerate(iter_files(chunks)):
+            if len(text) > cutoff:
+                yield self.collapsed(file_path(text), len(text),
+                                     fragment_url(file_no))
+            else:
+                yield self.highlight(text, style)
+
+    def stream_indexed(self, files: Iterable, load: Callable,
+                       fragment_url: Callable, cutoff: int,
+                       chunk_size: int = 256 * 1024,
+                       style: str = None) -> Iterator[str]:
+        """ Render a large diff file by file using its file index
+
+        Like stream, but collapsed files are never read at all and the
+        other files are read in runs of consecutive files of up to
+        chunk_size characters.
+
+        Parameters
+        ----------
+        files : Iterable
+            Rows of the file index (file_no, path, diff_offset,
+            diff_length), in diff order
+        load : Callable
+            Returns the diff text at (offset, length)
+        fragment_url : Callable
+            Returns the URL rendering the file with the given number
+        cutoff : int
+            Size (characters) above which a file is collapsed
+        chunk_size : int
+        style : str
+
+        Returns
+        -------
+        Iterator[str]
+
+        """
+        run = []
+
+        def flush():
+            start = run[0].get('diff_offset')
+            text = load(start, sum(f.get('diff_length') for f in run))
+            for item in run:
+                offset = item.get('diff_offset') - start
+                yield self.highlight(
+                    text[offset:offset + item.get('diff_length')], style)
+            run.clear()
+
+        for item in files:
+            length = item.get('diff_length')
+            if run and (sum(f.get('diff_length') for f in run) + length >
+                        chunk_size or length > cutoff):
+                yield from flush()
+            if length > cutoff:
+                yield self.collapsed(item.get('path'), length,
+                                     fragment_url(item.get('file_no')))
+            else:
+                run.append(item)
+        if run:
+            yield from flush()
+
+    @staticmethod
+    def collapsed(path: str, size: int, url: str) -> str:
+        """ Placeholder of a file that is loaded on demand
+
+        """
+        return ('<div class="diff-collapsed alert alert-secondary">'
+                '{} ({:,} characters) <a href="{}">Load diff</a>'
+                '</div>'.format(escape(path), size, escape(url)))
+
+    def warm(self, project_id: Any, revision_id: Any, diff: str,
+             style: str = None):
+        """ Render a freshly inserted revision into the cache
+
+        """
+        if self.cache is None:
+            return
+        style = style or self.style
+        self.cache.set(self.key(project_id, revision_id, style),
+                       self.highlight(diff, style))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""Compression and incremental reading of stored diffs."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import lzma
+import zlib
+import codecs
+import hashlib
+from typing import Iterable, Iterator
+
+
+class _Identity(object):
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        return data
+
+    @staticmethod
+    def flush() -> bytes:
+        return b''
+
+
+class _Lzma(object):
+    def __init__(self):
+        self._decompressor = lzma.LZMADecompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+    @staticmethod
+    def flush() -> bytes:
+        return b''
+
+
+# a dictionary of 1 MiB instead of the 8 MiB of preset 6: the readers
+# allocate the dictionary size for every blob they decompress
+_LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6,
+                  'dict_size': 1024 * 1024}]
+
+# method -> (compress, decompressor factory)
+METHODS = {
+    'none': (lambda data: data, _Identity),
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompressobj),
+    'lzma': (lambda data: lzma.compress(data, filters=_LZMA_FILTERS),
+             _Lzma),
+}
+
+
+def digest(text: str) -> bytes:
+    """ SHA-256 of the text (UTF-8), the address of its blob
+
+    """
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def compress(text: str, method: str = 'zlib') -> bytes:
+    """ Compress the text (UTF-8) with one of METHODS
+
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown compression {}'.format(method))
+    return METHODS[method][0](text.encode('utf-8'))
+
+
+def decode_chunks(chunks: Iterable[bytes], method: str) -> Iterator[str]:
+    """ Decompress and decode a stored blob read in pieces
+
+    Only one piece of the compressed and decompressed data is held at a
+    time, whatever the size of the diff.
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        The compressed blob, in pieces
+    method : str
+
+    Returns
+    -------
+    Iterator[str]
+
+    """
+    decompressor = METHODS[method][1]()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        text = decoder.decode(decompressor.decompress(chunk))
+        if text:
+            yield text
+    text = decoder.decode(decompressor.flush(), final=True)
+    if text:
+        yield text
+
+
+class SequentialReader(object):
+    """ Read parts of a text at increasing offsets from a stream of it
+
+    Returns the same as text[offset:offset + length] as long as the
+    offsets do not go backwards, consuming the stream only as far as
+    needed (e.g. the files of a diff index, in order).
+
+    Parameters
+    ----------
+    chunks : Iterable[str]
+
+    """
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        # offset of the first character of the buffer
+        self._start = 0
+
+    def __call__(self, offset: int, length: int) -> str:
+        if offset < self._start:
+            raise ValueError('SequentialReader can not go backwards')
+        end = offset + length
+        while self._start + len(self._buffer) < end:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if self._start + len(self._buffer) <= offset:
+                # nothing of the buffer is needed anymore
+                self._start += len(self._buffer)
+                self._buffer = chunk
+            else:
+                self._buffer += chunk
+        # drop what is before the requested part
+        skip = min(offset - self._start, len(self._buffer))
+        self._buffer = self._buffer[skip:]
+        self._start += skip
+        return self._buffer[:length]
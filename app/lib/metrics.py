@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+"""Prometheus metrics shared by all uWSGI workers through mmap files."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import os
+import glob
+import json
+import mmap
+import time
+import fcntl
+import bisect
+import struct
+import threading
+from functools import lru_cache
+from typing import Iterator, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_INITIAL_SIZE = 64 * 1024
+
+# counters and histograms of the workers that exited
+_EXITED = 'exited.db'
+
+
+@lru_cache(maxsize=4096)
+def _key(kind: str, name: str, suffix: str, labels: tuple) -> bytes:
+    return json.dumps([kind, name, suffix, labels]).encode('utf-8')
+
+
+class MmapValues(object):
+    """ Float values by key in a memory mapped file
+
+    The file is written by a single process only, so other processes can
+    read it at any time without locking: a value is an aligned 8 byte
+    write and new entries are published by updating the used size after
+    they are complete.
+
+    Layout: used size (uint32, padded to 8 bytes), then entries made of
+    the key length (uint32), the key padded to 8 bytes and the value
+    (double).
+
+    Parameters
+    ----------
+    path : str
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+            size = _INITIAL_SIZE
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = struct.unpack_from('I', self._map, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            struct.pack_into('I', self._map, 0, self._used)
+        self._positions = {key: pos for key, _, pos in
+                           _entries(self._map, self._used)}
+
+        super().__init__()
+
+    def _position(self, key: bytes) -> int:
+        pos = self._positions.get(key)
+        if pos is None:
+            padding = 8 - (4 + len(key)) % 8
+            entry = struct.pack('I{}s{}xd'.format(len(key), padding),
+                                len(key), key, 0.0)
+            while self._used + len(entry) > len(self._map):
+                self._map.close()
+                self._file.truncate(len(self._map) * 2)
+                self._map = mmap.mmap(self._file.fileno(),
+                                      os.fstat(self._file.fileno()).st_size)
+            self._map[self._used:self._used + len(entry)] = entry
+            pos = self._positions[key] = self._used + len(entry) - 8
+            self._used += len(entry)
+            struct.pack_into('I', self._map, 0, self._used)
+        return pos
+
+    def add(self, key: bytes, value: float):
+        with self._lock:
+            pos = self._position(key)
+            struct.pack_into('d', self._map, pos,
+                             struct.unpack_from('d', self._map, pos)[0] +
+                             value)
+
+    def set(self, key: bytes, value: float):
+        with self._lock:
+            struct.pack_into('d', self._map, self._position(key), value)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _entries(data, used: int) -> Iterator[Tuple[bytes, float, int]]:
+    """ Key, value and value position of every entry
+
+    """
+    pos = 8
+    while pos < used:
+        length = struct.unpack_from('I', data, pos)[0]
+        key = bytes(data[pos + 4:pos + 4 + length])
+        pos += 4 + length
+        pos += 8 - pos % 8
+        yield key, struct.unpack_from('d', data, pos)[0], pos
+        pos += 8
+
+
+def _read(path: str) -> Iterator[Tuple[bytes, float, int]]:
+    """ Entries of a file of MmapValues, none if it can not be read
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return iter(())
+    if len(data) < 8:
+        return iter(())
+    return _entries(data, struct.unpack_from('I', data, 0)[0])
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+class Metrics(object):
+    """ Counters, gauges and histograms of all the workers
+
+    Every process writes its values to its own file in directory (see
+    MmapValues); render() sums the files of all workers. Counters of
+    workers that exited are kept, gauges only count for live workers.
+    A starting process folds the counters of the exited workers into one
+    file and deletes theirs, so the directory does not grow with every
+    respawn and a reused pid starts from an empty file.
+
+    Parameters
+    ----------
+    directory : str
+    buckets : tuple
+        Upper bounds of the histogram buckets (seconds)
+
+    """
+
+    def __init__(self, directory: str, buckets: tuple = BUCKETS):
+        self.directory = directory
+        self.buckets = tuple(sorted(buckets))
+        os.makedirs(directory, exist_ok=True)
+        self._pid = None
+        self._values = None
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def _store(self) -> MmapValues:
+        """ File of this process, opened lazily (after fork) """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._fold()
+                    self._values = MmapValues(os.path.join(
+                        self.directory, '{}.db'.format(os.getpid())))
+                    self._pid = os.getpid()
+        return self._values
+
+    def _files(self) -> Iterator[Tuple[str, int]]:
+        """ Path and pid of the file of every worker """
+        for path in glob.glob(os.path.join(self.directory, '*.db')):
+            try:
+                yield path, int(os.path.basename(path)[:-3])
+            except ValueError:
+                continue
+
+    def _locked(self, operation: int):
+        """ Lock file of the directory, flocked with operation """
+        lock = open(os.path.join(self.directory, '.lock'), 'a+b')
+        fcntl.flock(lock, operation)
+        return lock
+
+    def _fold(self):
+        """ Add the counters of exited workers to _EXITED, drop their files
+
+        The file of this pid, if any, was left by an exited process the
+        pid was reused from. Done under an exclusive lock, collect() never
+        sees the values twice or not at all.
+
+        """
+        with self._locked(fcntl.LOCK_EX):
+            exited = None
+            for path, pid in self._files():
+                if pid != os.getpid() and _alive(pid):
+                    continue
+                for key, value, _ in _read(path):
+                    if json.loads(key)[0] == 'gauge':
+                        continue
+                    if exited is None:
+                        exited = MmapValues(os.path.join(self.directory,
+                                                         _EXITED))
+                    exited.add(key, value)
+                os.remove(path)
+            if exited is not None:
+                exited.close()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """ Increase a counter
+
+        """
+        self._store().add(_key('counter', name, '',
+                               tuple(sorted(labels.items()))), value)
+
+    def total(self, name: str, value: float, **labels):
+        """ Set a counter kept elsewhere (e.g. cache hits of this process)
+
+        """
+        self._store().set(_key('counter', name, '',
+                               tuple(sorted(labels.items()))), value)
+
+    def gauge(self, name: str, value: float, **labels):
+        """ Set a gauge; the values of the live workers are summed up
+
+        """
+        self._store().set(_key('gauge', name, '',
+                               tuple(sorted(labels.items()))), value)
+
+    def observe(self, name: str, value: float, **labels):
+        """ Add an observation to a histogram
+
+        """
+        labels = tuple(sorted(labels.items()))
+        store = self._store()
+        index = bisect.bisect_left(self.buckets, value)
+        bound = self.buckets[index] if index < len(self.buckets) else '+Inf'
+        store.add(_key('histogram', name, '_bucket',
+                       labels + (('le', str(bound)),)), 1)
+        store.add(_key('histogram', name, '_sum', labels), value)
+        store.add(_key('histogram', name, '_count', labels), 1)
+
+    def timer(self, name: str, **labels):
+        """ Hook observing the duration passed to it (DiffRenderer.hooks) """
+        return lambda duration, *args: self.observe(name, duration, **labels)
+
+    def collect(self) -> dict:
+        """ Values summed over the files of all workers
+
+        Returns
+        -------
+        dict
+            {(kind, name, suffix, labels): value}
+
+        """
+        res = {}
+        with self._locked(fcntl.LOCK_SH):
+            files = list(self._files()) + [
+                (os.path.join(self.directory, _EXITED), None)]
+            for path, pid in files:
+                alive = None
+                for key, value, _ in _read(path):
+                    kind, name, suffix, labels = json.loads(key)
+                    if kind == 'gauge':
+                        if alive is None:
+                            alive = pid is not None and _alive(pid)
+                        if not alive:
+                            continue
+                    labels = tuple(tuple(pair) for pair in labels)
+                    key = (kind, name, suffix, labels)
+                    res[key] = res.get(key, 0.0) + value
+        return res
+
+    def render(self) -> str:
+        """ All metrics in the Prometheus text exposition format
+
+        Returns
+        -------
+        str
+
+        """
+        by_name = {}
+        for (kind, name, suffix, labels), value in self.collect().items():
+            by_name.setdefault((name, kind), {})[(suffix, labels)] = value
+
+        lines = []
+        for (name, kind), values in sorted(by_name.items()):
+            lines.append('# TYPE {} {}'.format(name, kind))
+            if kind != 'histogram':
+                for (_, labels), value in sorted(values.items()):
+                    lines.append('{}{} {}'.format(name, _labels(labels),
+                                                  _number(value)))
+                continue
+            for (suffix, labels), count in sorted(values.items()):
+                if suffix != '_count':
+                    continue
+                cumulative = 0.0
+                for bound in self.buckets + ('+Inf',):
+                    cumulative += values.get(
+                        ('_bucket', labels + (('le', str(bound)),)), 0.0)
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _labels(labels, (('le', str(bound)),)),
+                        _number(cumulative)))
+                lines.append('{}_sum{} {}'.format(
+                    name, _labels(labels),
+                    _number(values.get(('_sum', labels), 0.0))))
+                lines.append('{}_count{} {}'.format(name, _labels(labels),
+                                                    _number(count)))
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value: float) -> str:
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def instrument(app, metrics: Metrics, db, diff_renderer, caches: dict):
+    """ Collect the metrics of the application
+
+    Records the latency of every request per endpoint, template render
+    and diff highlighting times, queries per model (through DB.hooks),
+    and the pool and cache statistics of the worker after each request.
+
+    Parameters
+    ----------
+    app : Flask
+    metrics : Metrics
+    db : DB
+    diff_renderer : DiffRenderer
+    caches : dict
+        Caches to report, by name (None values are skipped)
+
+    """
+    from flask import g, request, before_render_template, template_rendered
+    from app.lib.query_log import fingerprint, TABLE_MODELS
+
+    rendering = threading.local()
+
+    def count_query(query: str, duration: float, rows: int):
+        table = fingerprint(query)[1]
+        model = TABLE_MODELS.get(table, table or 'unknown')
+        metrics.inc('schub_db_queries_total', model=model)
+        metrics.inc('schub_db_query_seconds_total', duration, model=model)
+
+    db.hooks.append(count_query)
+    diff_renderer.hooks.append(metrics.timer('schub_diff_render_seconds'))
+
+    def template_started(sender, template, context, **extra):
+        rendering.__dict__.setdefault('starts', []).append(
+            time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        starts = getattr(rendering, 'starts', None)
+        if starts:
+            metrics.observe('schub_template_render_seconds',
+                            time.perf_counter() - starts.pop(),
+                            template=template.name or 'string')
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request(response):
+        start = g.pop('request_start', None)
+        endpoint = request.endpoint or 'unknown'
+        if start is not None:
+            metrics.observe('schub_request_duration_seconds',
+                            time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc('schub_requests_total', endpoint=endpoint,
+                    status=response.status_code)
+        return response
+
+    @app.teardown_appcontext
+    def report_resources(exc):
+        # registered first, so it runs after the connections are released
+        pools = [('primary', db.pool)] + [
+            ('{}:{}'.format(r.host, r.port), r.pool) for r in db.replicas]
+        for name, pool in pools:
+            stats = pool.stats()
+            metrics.gauge('schub_db_pool_capacity',
+                          stats['size'] + stats['max_overflow'], pool=name)
+            metrics.gauge('schub_db_pool_open', stats['opened'], pool=name)
+            metrics.total('schub_db_pool_busy_seconds_total',
+                          stats['busy_time'], pool=name)
+            metrics.total('schub_db_pool_wait_seconds_total',
+                          stats['wait_time'], pool=name)
+            metrics.total('schub_db_pool_timeouts_total', stats['timeouts'],
+                          pool=name)
+        for name, cache in caches.items():
+            if cache is not None:
+                metrics.total('schub_cache_hits_total', cache.hits,
+                              cache=name)
+                metrics.total('schub_cache_misses_total', cache.misses,
+                              cache=name)
@@ -1,4 +1,5 @@
-from typing import Any
+from collections import defaultdict
+from typing import Any, Iterable
 from app.lib.table_view import TableView
 
 
@@ -6,8 +7,106 @@ class Model(TableView):
     """ Base model class for module entities
 
     """
+
+    # (field, scope fields) of an id numbered per scope, e.g. issue ids
+    # restarting from 1 in every project; allocated by add()/add_many().
+    # The scope fields are integers
+    sequence = None
+
     def add(self, data: dict, **kwargs: dict) -> Any:
-        return self.insert(data, **kwargs)
+        with self.link.unit_of_work():
+            data = self.allocate([data])[0]
+            res = self.insert(self.before_add(data, **kwargs), **kwargs)
+            if res:
+                self.after_add(data, **kwargs)
+        return res
+
+    def add_many(self, rows: Iterable, **kwargs: dict) -> int:
+        rows = list(rows)
+        with self.link.unit_of_work():
+            rows = self.allocate(rows)
+            res = self.insert_many(self.before_add_many(rows, **kwargs),
+                                   **kwargs)
+            if res:
+                self.after_add_many(rows, **kwargs)
+        return res
+
+    def allocate(self, rows: list) -> list:
+        """ Fill in the sequence field of the rows that miss it
+
+        One block of ids is reserved per scope, so importing many rows of
+        the same scope costs a single round trip.
+
+        Parameters
+        ----------
+        rows : list
+
+        Returns
+        -------
+        list
+            Copies of the rows with the ids assigned
+
+        """
+        if self.sequence is None:
+            return rows
+
+        from app.models.counters import Counters
+
+        field, scope_fields = self.sequence
+        pending = defaultdict(list)
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            if row.get(field) is None:
+                # ids from the URL are strings: '02' is the scope of 2
+                for key in scope_fields:
+                    row[key] = int(row.get(key))
+                pending[':'.join(str(row.get(key))
+                                 for key in scope_fields)].append(row)
+
+        counters = Counters()
+        for scope, scoped in pending.items():
+            first = counters.reserve(self.table_name, scope, len(scoped))
+            for i, row in enumerate(scoped):
+                row[field] = first + i
+        return rows
+
+    def with_related(self, rows: list, key: str, related: type = None,
+                     name: str = None, field: str = 'id',
+                     columns: Iterable = None) -> list:
+        """ Attach related records to the rows, loading them in one query
+
+        Parameters
+        ----------
+        rows : list
+            Records holding the reference
+        key : str
+            Name of the referencing field in the rows, or the name of one
+            of the declared relations of the model (without related)
+        related : type
+            Model class of the referenced records
+        name : str
+            Key to store the related record under (defaults to key)
+        field : str
+            Referenced field of the related model
+        columns : Iterable
+            Fields of the related records to load
+
+        Returns
+        -------
+        list
+            The same rows
+
+        """
+        if related is None:
+            relation = self.schema.relations[key]
+            name = name or key
+            key, related, field = (relation.key, relation.resolve(),
+                                   relation.field)
+        found = related().get_many((row.get(key) for row in rows), field,
+                                   columns=columns)
+        for row in rows:
+            row[name or key] = found.get(row.get(key))
+        return rows
 
     def edit(self, id: int, data: dict, ret: str = 'id',
              **kwargs: dict) -> Any:
@@ -16,8 +115,9 @@ class Model(TableView):
             id, ret)
 
     def remove(self, id: int) -> int:
-        self.before_remove(id)
-        return self.delete_by_id(id)
+        with self.link.unit_of_work():
+            self.before_remove(id)
+            return self.delete_by_id(id)
 
     def preprocess(self, data: dict, **kwargs: dict) -> dict:
         return data
@@ -25,6 +125,16 @@ class Model(TableView):
     def before_add(self, data: dict, **kwargs: dict) -> dict:
         return data
 
+    def before_add_many(self, rows: list, **kwargs: dict) -> list:
+        return [self.before_add(row, **kwargs) for row in rows]
+
+    def after_add(self, data: dict, **kwargs: dict):
+        pass
+
+    def after_add_many(self, rows: list, **kwargs: dict):
+        for row in rows:
+            self.after_add(row, **kwargs)
+
     def before_edit(self, id: int, data: dict, **kwargs) -> dict:
 
         return data
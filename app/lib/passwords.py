@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""Password hashing with tunable key derivation functions."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import os
+import hmac
+import time
+import fcntl
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class PasswordBusy(Exception):
+    """ Raised when too many hashes are already being computed """
+
+
+class SharedSlots(object):
+    """ Counting semaphore shared by the uWSGI workers, never waiting
+
+    Every slot is a lock file in path, taken with a non-blocking exclusive
+    flock on a descriptor of its own for as long as it is used; the kernel
+    drops the locks of a worker that dies. Without a path the slots are
+    counted in the process.
+
+    Parameters
+    ----------
+    size : int
+    path : str
+        Directory of the slot files
+
+    """
+
+    def __init__(self, size: int, path: str = None):
+        self.size = size
+        self.path = path
+        self._free = size
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+        super().__init__()
+
+    def acquire(self):
+        """ Take a free slot, None when all of them are taken
+
+        """
+        if not self.path:
+            with self._lock:
+                if self._free <= 0:
+                    return None
+                self._free -= 1
+                return True
+        for i in range(self.size):
+            slot = open(os.path.join(self.path, 'slot-{}'.format(i)), 'a+b')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                slot.close()
+                continue
+            return slot
+        return None
+
+    def release(self, slot):
+        """ Give back a slot returned by acquire()
+
+        """
+        if not self.path:
+            with self._lock:
+                self._free += 1
+            return
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+
+class PasswordHasher(object):
+    """ Hash and verify passwords, off the request thread and bounded
+
+    Hashes are stored with their algorithm, cost parameters and a per-user
+    salt, e.g. "scrypt$16384$8$1$<salt>$<hash>" or
+    "pbkdf2_sha256$600000$<salt>$<hash>", so the cost can be raised later;
+    needs_rehash() tells when a stored hash is weaker than the current
+    settings. Legacy hashes (a single SHA-256 over email, password and the
+    global salt) are still accepted so they can be migrated on login.
+
+    Parameters
+    ----------
+    algorithm : str
+        "scrypt" or "pbkdf2_sha256"
+    params : dict
+        Cost parameters: n, r, p for scrypt, iterations for PBKDF2
+    legacy_salt : str
+        Global salt of the legacy SHA-256 hashes
+    workers : int
+        Threads computing hashes (per process)
+    max_pending : int
+        Hashes allowed to run at the same time, over all the workers; more
+        fail at once with PasswordBusy
+    timeout : float
+        Seconds to wait for the result
+    slots_dir : str
+        Directory of the slots shared by the workers (see SharedSlots),
+        None to count them per process
+
+    """
+
+    defaults = {
+        'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1},
+        'pbkdf2_sha256': {'iterations': 600000},
+    }
+
+    def __init__(self, algorithm: str = 'scrypt', params: dict = None,
+                 legacy_salt: str = '', workers: int = 2,
+                 max_pending: int = 8, timeout: float = 10.0,
+                 slots_dir: str = None):
+        if algorithm not in self.defaults:
+            raise ValueError('Unknown password algorithm {}'.format(
+                algorithm))
+        self.algorithm = algorithm
+        self.params = dict(self.defaults[algorithm], **(params or {}))
+        self.legacy_salt = legacy_salt
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pid = None
+        self._executor = None
+        self._slots = SharedSlots(max_pending, slots_dir)
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """ Executor of this process, created lazily (after fork) """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='pwd')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        """ Run func in the pool, giving up at once when it is saturated """
+        pool = self._pool()
+        slot = self._slots.acquire()
+        if slot is None:
+            raise PasswordBusy('Too many password checks in progress')
+        try:
+            future = pool.submit(func, *args)
+        except BaseException:
+            self._slots.release(slot)
+            raise
+        future.add_done_callback(lambda _: self._slots.release(slot))
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise PasswordBusy('Password check timed out')
+
+    @staticmethod
+    def derive(algorithm: str, params: dict, pwd: str, salt: bytes) -> bytes:
+        """ Compute the raw key for the password
+
+        """
+        pwd = pwd.encode('utf-8')
+        if algorithm == 'scrypt':
+            n, r, p = int(params['n']), int(params['r']), int(params['p'])
+            return hashlib.scrypt(pwd, salt=salt, n=n, r=r, p=p, dklen=32,
+                                  maxmem=129 * r * n * p + 1024 * 1024)
+        return hashlib.pbkdf2_hmac('sha256', pwd, salt,
+                                   int(params['iterations']), 32)
+
+    def _encode(self, pwd: str) -> str:
+        salt = os.urandom(16)
+        key = self.derive(self.algorithm, self.params, pwd, salt)
+        if self.algorithm == 'scrypt':
+            cost = [self.params['n'], self.params['r'], self.params['p']]
+        else:
+            cost = [self.params['iterations']]
+        return '$'.join([self.algorithm] + [str(c) for c in cost] +
+                        [salt.hex(), key.hex()])
+
+    def _check(self, stored: str, pwd: str, email: str) -> bool:
+        parts = (stored or '').split('$')
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            params = {'n': parts[1], 'r': parts[2], 'p': parts[3]}
+        elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            params = {'iterations': parts[1]}
+        elif len(parts) == 1 and len(stored or '') == 64:
+            legacy = hashlib.sha256('{0}!{1}*{2}'.format(
+                email, pwd, self.legacy_salt).encode('utf-8')).hexdigest()
+            return hmac.compare_digest(legacy, stored)
+        else:
+            return False
+
+        try:
+            key = self.derive(parts[0], params, pwd, bytes.fromhex(parts[-2]))
+        except ValueError:
+            return False
+        return hmac.compare_digest(key.hex(), parts[-1])
+
+    @property
+    def dummy(self) -> str:
+        """ Hash of no password with the current settings
+
+        Verified instead of a stored hash when there is none (e.g. unknown
+        emails), so that it takes as long as checking a real password.
+
+        """
+        if self.algorithm == 'scrypt':
+            cost = [self.params['n'], self.params['r'], self.params['p']]
+        else:
+            cost = [self.params['iterations']]
+        return '$'.join([self.algorithm] + [str(c) for c in cost] +
+                        ['00' * 16, '00' * 32])
+
+    def hash(self, pwd: str) -> str:
+        """ Hash the password with the current settings
+
+        Parameters
+        ----------
+        pwd : str
+
+        Returns
+        -------
+        str
+
+        """
+        return self._run(self._encode, pwd)
+
+    def verify(self, stored: str, pwd: str, email: str = '') -> bool:
+        """ Check the password against the stored hash
+
+        Parameters
+        ----------
+        stored : str
+        pwd : str
+        email : str
+            Needed for legacy hashes only
+
+        Returns
+        -------
+        bool
+
+        Raises
+        ------
+        PasswordBusy
+            When the pool is saturated
+
+        """
+        return self._run(self._check, stored, pwd, email)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """ Whether the stored hash is weaker than the current settings
+
+        """
+        parts = (stored or '').split('$')
+        if parts[0] != self.algorithm:
+            return True
+        if self.algorithm == 'scrypt':
+            current = [self.params['n'], self.params['r'], self.params['p']]
+        else:
+            current = [self.params['iterations']]
+        try:
+            return any(int(cost) < value
+                       for cost, value in zip(parts[1:], current))
+        except ValueError:
+            return True
+
+
+def calibrate(algorithm: str = 'scrypt', target: float = 0.25) -> dict:
+    """ Find the cost parameters taking about target seconds per hash
+
+    The cost is doubled until one hash takes at least target seconds on
+    this machine.
+
+    Parameters
+    ----------
+    algorithm : str
+    target : float
+
+    Returns
+    -------
+    dict
+
+    """
+    params = dict(PasswordHasher.defaults[algorithm])
+    key = 'n' if algorithm == 'scrypt' else 'iterations'
+    params[key] = 2 ** 10 if algorithm == 'scrypt' else 10000
+    while True:
+        start = time.perf_counter()
+        PasswordHasher.derive(algorithm, params, 'calibration', b'0' * 16)
+        if time.perf_counter() - start >= target:
+            return params
+        params[key] *= 2
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""Bounded connection pool used by the database connector."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Callable
+
+
+class PoolTimeout(Exception):
+    """ Raised when no connection could be checked out in time """
+
+
+class PooledConnection(object):
+    """ Connection handle with the bookkeeping needed by the pool
+
+    """
+    __slots__ = ('conn', 'pid', 'created', 'last_used', 'checked_out')
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.pid = os.getpid()
+        self.created = self.last_used = self.checked_out = time.monotonic()
+
+
+class Pool(object):
+    """ Bounded pool of lazily opened connections
+
+    Connections are never opened at construction time, so a pool built in
+    the uWSGI master is safe to inherit: the first checkout in every worker
+    notices the changed pid and starts from an empty pool.
+
+    Parameters
+    ----------
+    connect : Callable
+        Factory returning a new DB-API connection
+    size : int
+        Number of connections kept open while idle
+    max_overflow : int
+        Extra connections allowed under load, closed on release
+    timeout : float
+        Seconds to wait for a free connection before giving up
+    recycle : float
+        Maximum lifetime of a connection in seconds
+    idle_timeout : float
+        Idle connections older than this are closed instead of reused
+    ping_interval : float
+        Connections idle for longer than this are pinged before reuse
+
+    """
+
+    def __init__(self, connect: Callable, size: int = 5,
+                 max_overflow: int = 5, timeout: float = 10.0,
+                 recycle: float = 3600, idle_timeout: float = 300,
+                 ping_interval: float = 30):
+        self.connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self._reset()
+
+        super().__init__()
+
+    def _reset(self):
+        """ Forget every connection (used after fork)
+
+        Inherited sockets belong to the parent process, so they are dropped
+        without being closed.
+
+        """
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._opened = 0
+        # totals since the start of the process, for the metrics
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def _expired(self, item: PooledConnection, now: float) -> bool:
+        return (now - item.created > self.recycle or
+                now - item.last_used > self.idle_timeout)
+
+    def _alive(self, item: PooledConnection, now: float) -> bool:
+        """ Check liveness only for connections idle long enough to be stale
+
+        """
+        if now - item.last_used < self.ping_interval:
+            return True
+        try:
+            item.conn.ping(reconnect=False)
+        except Exception:
+            return False
+        return True
+
+    def _close(self, item: PooledConnection):
+        try:
+            item.conn.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> PooledConnection:
+        """ Check a connection out of the pool
+
+        Returns
+        -------
+        PooledConnection
+
+        """
+        if self._pid != os.getpid():
+            self._reset()
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            item = None
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._idle:
+                        # LIFO keeps the hottest connections in use and lets
+                        # the rest age out through idle_timeout
+                        item = self._idle.pop()
+                        if self._expired(item, now):
+                            self._opened -= 1
+                            self._close(item)
+                            item = None
+                            continue
+                        break
+                    if self._opened < self.size + self.max_overflow:
+                        self._opened += 1
+                        break
+                    if now >= deadline:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            'No database connection available after '
+                            '{}s'.format(self.timeout))
+                    self._cond.wait(deadline - now)
+
+            if item is None:
+                try:
+                    item = PooledConnection(self.connect())
+                except Exception:
+                    self._discarded()
+                    raise
+                self.wait_time += item.checked_out - start
+                return item
+
+            if self._alive(item, now):
+                item.last_used = item.checked_out = now
+                self.wait_time += now - start
+                return item
+
+            self._close(item)
+            self._discarded()
+
+    def release(self, item: PooledConnection, discard: bool = False):
+        """ Return a connection to the pool
+
+        Parameters
+        ----------
+        item : PooledConnection
+        discard : bool
+            Close the connection instead of keeping it (e.g. when broken)
+
+        """
+        if item.pid != os.getpid() or self._pid != item.pid:
+            # checked out before a fork, it is not ours to pool
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            self.busy_time += now - item.checked_out
+            if (not discard and len(self._idle) < self.size and
+                    now - item.created <= self.recycle):
+                item.last_used = now
+                self._idle.append(item)
+                self._cond.notify()
+                return
+            self._opened -= 1
+            self._cond.notify()
+        self._close(item)
+
+    def _discarded(self):
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    def dispose(self):
+        """ Close all idle connections
+
+        """
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for item in idle:
+            self._close(item)
+
+    def stats(self) -> dict:
+        """ Current utilization of the pool
+
+        Returns
+        -------
+        dict
+
+        """
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'opened': self._opened,
+                'idle': idle,
+                'in_use': self._opened - idle,
+                'busy_time': self.busy_time,
+                'wait_time': self.wait_time,
+                'timeouts': self.timeouts,
+            }
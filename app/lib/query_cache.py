@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+"""Query result cache invalidated by per-table versions."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import os
+import re
+import mmap
+import fcntl
+import pickle
+import struct
+import zlib
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Any, Iterable
+
+from app.lib.cache import Cache
+
+_READ_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)', re.I)
+_WRITTEN_TABLE = re.compile(
+    r'^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|'
+    r'DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|ALTER\s+TABLE|'
+    r'DROP\s+TABLE(?:\s+IF\s+EXISTS)?|RENAME\s+TABLE)\s+`?(\w+)', re.I)
+
+_SLOTS = 4096
+
+
+@lru_cache(maxsize=4096)
+def tables_of(query: str) -> tuple:
+    """ Tables a SELECT reads, joins and subqueries included
+
+    """
+    return tuple(sorted(set(_READ_TABLES.findall(query))))
+
+
+@lru_cache(maxsize=4096)
+def written_table(query: str) -> str:
+    """ Table changed by a statement, None for reads
+
+    """
+    match = _WRITTEN_TABLE.match(query)
+    return match.group(1) if match else None
+
+
+class TableVersions(object):
+    """ Version counter of every table, shared by the uWSGI workers
+
+    The counters live in a memory mapped file (one 8 byte slot per table
+    hash, collisions only cost extra invalidations) read without locking
+    and increased under an exclusive flock. The first slot holds a random
+    epoch, so that entries of a shared cache tier written before the file
+    was recreated can not match again. Without a path the versions are
+    kept in the process.
+
+    Parameters
+    ----------
+    path : str
+
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._pid = None
+        self._map = None
+        self._file = None
+        self._local = {}
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        super().__init__()
+
+    def _mapped(self) -> mmap.mmap:
+        """ The shared file, opened lazily per process (after fork) """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # a descriptor of its own: flocks of a file description
+                    # inherited through fork would not exclude each other
+                    self._file = open(self.path, 'a+b')
+                    fcntl.flock(self._file, fcntl.LOCK_EX)
+                    try:
+                        if os.fstat(self._file.fileno()).st_size < \
+                                (_SLOTS + 1) * 8:
+                            self._file.truncate((_SLOTS + 1) * 8)
+                        self._map = mmap.mmap(self._file.fileno(),
+                                              (_SLOTS + 1) * 8)
+                        if struct.unpack_from('Q', self._map, 0)[0] == 0:
+                            struct.pack_into('Q', self._map, 0, int.from_bytes(
+                                os.urandom(8), 'little') | 1)
+                    finally:
+                        fcntl.flock(self._file, fcntl.LOCK_UN)
+                    self._pid = os.getpid()
+        return self._map
+
+    @staticmethod
+    def _slot(table: str) -> int:
+        return (zlib.crc32(table.encode('utf-8')) % _SLOTS + 1) * 8
+
+    @property
+    def epoch(self) -> int:
+        if not self.path:
+            return 0
+        return struct.unpack_from('Q', self._mapped(), 0)[0]
+
+    def get(self, tables: Iterable) -> tuple:
+        """ Current versions of the tables
+
+        """
+        if not self.path:
+            return tuple(self._local.get(table, 0) for table in tables)
+        data = self._mapped()
+        return tuple(struct.unpack_from('Q', data, self._slot(table))[0]
+                     for table in tables)
+
+    def bump(self, table: str):
+        """ Increase the version of the table, stale entries never match
+
+        """
+        if not self.path:
+            with self._lock:
+                self._local[table] = self._local.get(table, 0) + 1
+            return
+        data = self._mapped()
+        pos = self._slot(table)
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                struct.pack_into('Q', data, pos,
+                                 struct.unpack_from('Q', data, pos)[0] + 1)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+class CachedResult(object):
+    """ Cursor-like access to rows served from the cache
+
+    """
+
+    def __init__(self, rows: list):
+        self._rows = rows
+        self._pos = 0
+        self.rowcount = len(rows)
+
+    def fetchone(self) -> Any:
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchmany(self, size: int = 1) -> list:
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self) -> list:
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._rows = []
+        self._pos = 0
+
+
+class QueryCache(object):
+    """ Result cache of SELECT statements
+
+    Entries are keyed by the compiled SQL, its arguments and the versions
+    of every table the statement reads (joins and subqueries included).
+    Registered in DB.hooks, the cache bumps the version of the table
+    written by every INSERT, UPDATE, DELETE, TRUNCATE or DDL statement,
+    and once more when the transaction commits, so entries read before
+    the change are never matched again and simply age out of the LRU.
+
+    Reads bypass the cache once the request wrote anything (to read its
+    own, maybe uncommitted, writes) and misses are filled from the
+    primary: a lagging replica would store old rows under new versions.
+
+    Parameters
+    ----------
+    db : DB
+    cache : Cache
+        Storage of the pickled results, e.g. an LRUCache bounded in bytes
+        or a TieredCache with a tier shared by the workers
+    versions : TableVersions
+
+    """
+
+    def __init__(self, db, cache: Cache, versions: TableVersions):
+        self.db = db
+        self.cache = cache
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        super().__init__()
+
+    def _key(self, query: str, args: Any, cursor: type,
+             tables: tuple) -> str:
+        if isinstance(args, dict):
+            args = sorted(args.items())
+        return 'q:' + hashlib.sha1(repr((
+            self.versions.epoch, self.versions.get(tables), query, args,
+            cursor.__name__ if cursor else None)).encode('utf-8')).hexdigest()
+
+    def fetch(self, query: str, args: Any = None, cursor: type = None):
+        """ Rows of the SELECT, from the cache when possible
+
+        Parameters
+        ----------
+        query : str
+        args : Any
+        cursor : type
+            Cursor class of the rows (e.g. RecordCursor)
+
+        Returns
+        -------
+        CachedResult or cursor
+            Rows are fresh copies on every call, the caller may change them
+
+        """
+        if self.db.dirty:
+            self.bypassed += 1
+            return self.db.execute(query, args, cursor, read_only=True)
+
+        key = self._key(query, args, cursor, tables_of(query))
+        data = self.cache.get(key)
+        if data is not None:
+            self.hits += 1
+            return CachedResult(pickle.loads(data))
+
+        self.misses += 1
+        cur = self.db.execute(query, args, cursor)
+        rows = list(cur.fetchall())
+        cur.close()
+        self.cache.set(key, pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        return CachedResult(rows)
+
+    def __call__(self, query: str, duration: float, rows: int):
+        table = written_table(query)
+        if table is None:
+            return
+        self.versions.bump(table)
+        if self.db.transaction:
+            # readers may cache the old rows until the commit
+            self.db.on_commit(lambda: self.versions.bump(table))
+
+    def stats(self) -> dict:
+        """ Hit/miss counters of the cache
+
+        Returns
+        -------
+        dict
+
+        """
+        res = self.cache.stats()
+        res.update({'hits': self.hits, 'misses': self.misses,
+                    'bypassed': self.bypassed})
+        return res
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Per-query instrumentation: timings, fingerprints and the slow-query log."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import re
+import logging
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Tuple
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|"
+                       r"%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+`?(\w+)', re.I)
+
+# model class names by table, registered by DataView
+TABLE_MODELS = {}
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(query: str) -> Tuple[str, str]:
+    """ Normalize the statement and find the table it is about
+
+    Literals and placeholders become "?" and lists of them "(...)", so
+    the same statement with different arguments gets the same
+    fingerprint. Cached: the statements are mostly compiled plans, i.e.
+    the very same strings over and over.
+
+    Parameters
+    ----------
+    query : str
+
+    Returns
+    -------
+    Tuple[str, str]
+        Fingerprint and the (first) table of the statement
+
+    """
+    normalized = _SPACES.sub(' ', _LISTS.sub('(...)', _LITERALS.sub(
+        '?', query))).strip()
+    table = _TABLE.search(query)
+    return normalized, table.group(1) if table else ''
+
+
+class RequestStats(object):
+    """ Queries run while serving one request
+
+    """
+    __slots__ = ('route', 'queries', 'time', 'fingerprints')
+
+    def __init__(self, route: str):
+        self.route = route
+        self.queries = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def repeated(self, threshold: int) -> list:
+        """ Statements run at least threshold times (likely N+1 patterns)
+
+        """
+        return [(fp, n) for fp, n in self.fingerprints.most_common()
+                if n >= threshold and fp.startswith('SELECT')]
+
+    def server_timing(self, threshold: int) -> str:
+        """ Value of the Server-Timing header
+
+        """
+        desc = '{} queries'.format(self.queries)
+        repeated = self.repeated(threshold)
+        if repeated:
+            desc += ', {} repeated'.format(len(repeated))
+        return 'db;dur={:.2f};desc="{}"'.format(self.time * 1000, desc)
+
+
+class QueryLog(object):
+    """ Query hook of the DB collecting per-request statistics
+
+    Registered in DB.hooks, it is called after every statement. Statements
+    slower than slow_ms are logged right away; at the end of the request
+    statements repeated n_plus_one times or more are reported.
+
+    Parameters
+    ----------
+    slow_ms : float
+        Threshold of the slow-query log, None disables it
+    n_plus_one : int
+        Repetitions of a SELECT within a request reported as N+1
+    logger : logging.Logger
+
+    """
+
+    def __init__(self, slow_ms: float = 200, n_plus_one: int = 10,
+                 logger: logging.Logger = None):
+        self.slow = slow_ms / 1000 if slow_ms is not None else None
+        self.n_plus_one = n_plus_one
+        self.logger = logger or logging.getLogger(__name__)
+        self._local = threading.local()
+
+        super().__init__()
+
+    def begin(self, route: str):
+        """ Start collecting the queries of a request
+
+        """
+        self._local.stats = RequestStats(route)
+
+    def end(self) -> RequestStats:
+        """ Stop collecting and report repeated statements
+
+        Returns
+        -------
+        RequestStats
+            None if no request was being collected
+
+        """
+        stats = getattr(self._local, 'stats', None)
+        self._local.stats = None
+        if stats is not None and self.n_plus_one:
+            for fp, count in stats.repeated(self.n_plus_one):
+                self.logger.warning('N+1: %d x [%s] in %s', count, fp,
+                                    stats.route)
+        return stats
+
+    @property
+    def current(self) -> RequestStats:
+        return getattr(self._local, 'stats', None)
+
+    def __call__(self, query: str, duration: float, rows: int):
+        fp, table = fingerprint(query)
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats.queries += 1
+            stats.time += duration
+            stats.fingerprints[fp] += 1
+        if self.slow is not None and duration >= self.slow:
+            self.logger.warning(
+                'slow query %.1f ms, %d rows, %s (%s): %s', duration * 1000,
+                rows, stats.route if stats else '-',
+                TABLE_MODELS.get(table, table), fp)
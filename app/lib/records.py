@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""Compact, slot-based rows as an alternative to dict rows."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import keyword
+from collections.abc import MutableMapping
+from functools import lru_cache
+from typing import Any, Callable
+
+from pymysql.cursors import Cursor, DictCursorMixin, SSCursor
+
+
+class Record(MutableMapping):
+    """ Row storing its columns in __slots__ instead of a dict
+
+    Behaves like the dict rows of DictCursor (row['x'], row.get('x'),
+    keys(), items(), dict(row)) and adds attribute access (row.x). Keys
+    that are not columns of the query (e.g. related rows attached by a
+    route) are kept in a small dict created on first use.
+
+    """
+    __slots__ = ('_extra',)
+    _fields = ()
+    _index = frozenset()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._index:
+            return getattr(self, key)
+        extra = getattr(self, '_extra', None)
+        return default if extra is None else extra.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._index:
+            return getattr(self, key)
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self._index:
+            setattr(self, key, value)
+            return
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            extra = self._extra = {}
+        extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self._index:
+            raise TypeError('Column {} of a record cannot be deleted'.format(
+                key))
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            raise KeyError(key)
+        del extra[key]
+
+    def __contains__(self, key: Any) -> bool:
+        if key in self._index:
+            return True
+        extra = getattr(self, '_extra', None)
+        return extra is not None and key in extra
+
+    def __iter__(self):
+        yield from self._fields
+        extra = getattr(self, '_extra', None)
+        if extra:
+            yield from extra
+
+    def __len__(self) -> int:
+        extra = getattr(self, '_extra', None)
+        return len(self._fields) + (len(extra) if extra else 0)
+
+    def __repr__(self) -> str:
+        return '{}({!r})'.format(self.__class__.__name__, dict(self))
+
+    def __reduce__(self):
+        # generated classes cannot be looked up by name when unpickling
+        return (_rebuild, (self._fields,
+                           tuple(getattr(self, f) for f in self._fields),
+                           getattr(self, '_extra', None)))
+
+
+def _rebuild(fields: tuple, row: tuple, extra: dict) -> Any:
+    record = record_class(fields)(row)
+    if extra:
+        for key, value in extra.items():
+            record[key] = value
+    return record
+
+
+def _dict_row(fields: tuple) -> Callable:
+    return lambda row: dict(zip(fields, row))
+
+
+@lru_cache(maxsize=1024)
+def record_class(fields: tuple) -> Callable:
+    """ Generate (once) the record class for a list of column names
+
+    Parameters
+    ----------
+    fields : tuple
+        Column names, in the order of the values in the rows
+
+    Returns
+    -------
+    Callable
+        Builds a row from a tuple of values; plain dicts are built when
+        the names are not usable as slots (duplicates, expressions, ...)
+
+    """
+    reserved = set(dir(Record))
+    if not fields or len(set(fields)) != len(fields) or any(
+            not f.isidentifier() or keyword.iskeyword(f) or f in reserved
+            for f in fields):
+        return _dict_row(fields)
+
+    # assigning all slots in one generated statement is much faster than
+    # a setattr() loop, the same trick collections.namedtuple relies on
+    source = 'def __init__(self, row):\n    {}, = row\n'.format(
+        ', '.join('self.' + f for f in fields))
+    namespace = {}
+    exec(source, namespace)
+    return type('Record', (Record,), {
+        '__module__': __name__,
+        '__slots__': fields,
+        '__init__': namespace['__init__'],
+        '_fields': fields,
+        '_index': frozenset(fields),
+    })
+
+
+class RecordCursorMixin(DictCursorMixin):
+    """ Build Record rows instead of dicts """
+
+    _record = None
+    _record_fields = None
+
+    def _conv_row(self, row):
+        if row is None:
+            return None
+        if self._record_fields is not self._fields:
+            self._record_fields = self._fields
+            self._record = record_class(tuple(self._fields))
+        return self._record(row)
+
+
+class RecordCursor(RecordCursorMixin, Cursor):
+    """ Buffered cursor returning Record rows """
+
+
+class SSRecordCursor(RecordCursorMixin, SSCursor):
+    """ Unbuffered cursor returning Record rows """
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""Model metadata, computed once per model class."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+from types import MappingProxyType
+from typing import Iterable
+
+# model classes by name, for relations declared with the model name
+MODELS = {}
+
+
+class Relation(object):
+    """ Reference from a field of a model to a field of another model
+
+    Parameters
+    ----------
+    key : str
+        Referencing field
+    model : str
+        Name of the referenced model class
+    field : str
+        Referenced field
+
+    """
+    __slots__ = ('key', 'model', 'field')
+
+    def __init__(self, key: str, model: str, field: str = 'id'):
+        self.key = key
+        self.model = model
+        self.field = field
+
+    def resolve(self) -> type:
+        """ The referenced model class
+
+        """
+        try:
+            return MODELS[self.model]
+        except KeyError:
+            raise Exception('Unknown model {}'.format(self.model))
+
+
+class Schema(object):
+    """ Immutable description of a model's table
+
+    Built from the class attributes of the model (table_name, fields,
+    primary_key, relations) when the class is defined, and shared by all
+    its instances.
+
+    Parameters
+    ----------
+    table_name : str
+    fields : dict
+        Field name -> options ("alias", "rdonly", "json", "deferred")
+    primary_key : Iterable
+        Fields of the primary key, "id" by default if present
+    relations : dict
+        Relation name -> (key, model name[, field])
+
+    """
+    __slots__ = ('table_name', 'fields', 'columns', 'default_columns',
+                 'attr_list', 'aliases', 'rdonly', 'json', 'deferred',
+                 'primary_key', 'pk_where', 'relations')
+
+    def __init__(self, table_name: str, fields: dict,
+                 primary_key: Iterable = None, relations: dict = None):
+        set_ = super().__setattr__
+        set_('table_name', table_name)
+        set_('fields', MappingProxyType({
+            key: MappingProxyType(dict(options or {}))
+            for key, options in fields.items()}))
+        set_('columns', tuple(self.fields))
+        set_('aliases', MappingProxyType({
+            key: options['alias'] for key, options in self.fields.items()
+            if 'alias' in options}))
+        set_('rdonly', self._flagged('rdonly'))
+        set_('json', self._flagged('json'))
+        set_('deferred', self._flagged('deferred'))
+        set_('default_columns', tuple(key for key in self.columns
+                                      if key not in self.deferred))
+        set_('attr_list', tuple(map(self.column_name, self.default_columns)))
+
+        if primary_key is None:
+            primary_key = ('id',) if 'id' in self.fields else ()
+        set_('primary_key', tuple(primary_key))
+        set_('pk_where', ' AND '.join(
+            '{0}.{1}=%(_pk_{1})s'.format(table_name, key)
+            for key in self.primary_key))
+        set_('relations', MappingProxyType({
+            name: Relation(*spec) for name, spec in (relations or {}).items()
+        }))
+
+    def __setattr__(self, key, value):
+        raise AttributeError('Schema of {} is read-only'.format(
+            self.table_name))
+
+    def _flagged(self, option: str) -> frozenset:
+        return frozenset(key for key, options in self.fields.items()
+                         if options.get(option, False) is True)
+
+    def column_name(self, key: str) -> str:
+        """ Column expression of the field (with alias if specified)
+
+        Names which are not fields of the model are taken as SQL
+        expressions, e.g. "COUNT(*) AS count".
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        str
+
+        """
+        if key not in self.fields:
+            return key
+        if key in self.aliases:
+            return "{}.{} AS {}".format(self.table_name, key,
+                                        self.aliases[key])
+        return "{}.{}".format(self.table_name, key)
+
+    def pk_values(self, item_id) -> dict:
+        """ Arguments of pk_where for the value(s) of the primary key
+
+        Parameters
+        ----------
+        item_id : Any
+            The value, a sequence of values in key order, or a mapping
+
+        Returns
+        -------
+        dict
+
+        """
+        if not self.primary_key:
+            raise Exception('{} has no primary key'.format(self.table_name))
+        if isinstance(item_id, dict) or hasattr(item_id, 'keys'):
+            values = [item_id[key] for key in self.primary_key]
+        elif isinstance(item_id, (tuple, list)):
+            values = list(item_id)
+        else:
+            values = [item_id]
+        if len(values) != len(self.primary_key):
+            raise Exception('{} expects a key of ({})'.format(
+                self.table_name, ', '.join(self.primary_key)))
+        return {'_pk_' + key: value
+                for key, value in zip(self.primary_key, values)}
@@ -9,14 +9,72 @@ __license__ = 'All Rights Reserved'
 __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
+import json
+import base64
+import binascii
 from typing import Any, Iterable
 from app.lib.data_view import DataView
 
 
+class Page(list):
+    """ Rows of one keyset page with the cursors of its neighbours
+
+    """
+
+    def __init__(self, rows: Iterable = (), next: str = None,
+                 prev: str = None):
+        self.next = next
+        self.prev = prev
+        super().__init__(rows)
+
+    @staticmethod
+    def encode_cursor(direction: str, keys: list) -> str:
+        """ Build an opaque cursor from the sort keys of a row
+
+        """
+        data = json.dumps([direction, keys], default=str,
+                          separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode(
+            'ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        """ Get the direction and the sort keys back from a cursor
+
+        Returns
+        -------
+        tuple
+            (None, None) for a missing or malformed cursor
+
+        """
+        if not cursor:
+            return None, None
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, keys = json.loads(data.decode('utf-8'))
+        except (ValueError, TypeError, binascii.Error):
+            return None, None
+        if direction not in ('a', 'b') or not isinstance(keys, list):
+            return None, None
+        return direction, keys
+
+
 class TableView(DataView):
-    def __init__(self):
-        self.PAGE_SIZE = 10
-        super(TableView, self).__init__()
+    PAGE_SIZE = 10
+
+    # operators available to get() as field__op=value
+    OPS = {
+        'eq': '{col} = {val}',
+        'ne': '{col} <> {val}',
+        'lt': '{col} < {val}',
+        'lte': '{col} <= {val}',
+        'gt': '{col} > {val}',
+        'gte': '{col} >= {val}',
+        'like': '{col} LIKE {val} COLLATE utf8mb4_bin',
+        'ilike': 'LOWER({col}) LIKE LOWER({val})',
+        'in': '{col} IN {val}',
+        'between': '{col} BETWEEN {val}',
+    }
 
     def get(self, **kwargs: dict) -> object:
         """ Finds one record by fields
@@ -25,7 +83,12 @@ class TableView(DataView):
         ----------
         kwargs : dict
             Mapping of fields and values (field=value) and
-            "order_by", "lock", "ci" (case insensitive) and op arguments
+            "order_by", "lock", "columns" and op arguments.
+            Fields are compared for equality (an index seek); other
+            operators are opted into per field with field__op=value, op
+            being one of OPS (e.g. email__ilike='%@example.com',
+            id__in=[1, 2], date_added__between=(start, end)), or for all
+            fields with op=...
 
         Returns
         -------
@@ -34,30 +97,101 @@ class TableView(DataView):
         """
         order_by = kwargs.pop('order_by', '')
         lock = kwargs.pop('lock', False)
+        columns = kwargs.pop('columns', None)
         op = kwargs.pop('op', None)
 
-        ops = {
-            str: 'LIKE',
-            int: '=',
-            float: '='
-        }
+        where, values = self.conditions(kwargs, op)
+        return self.find(where, values, order_by, lock, columns)
+
+    def conditions(self, filters: dict, op: str = None) -> tuple:
+        """ Build the WHERE clause for field[__op]=value filters
+
+        Parameters
+        ----------
+        filters : dict
+        op : str
+            Default operator (name from OPS or an SQL operator)
 
+        Returns
+        -------
+        tuple
+            The where template and its values
+
+        """
         where = []
-        for key, val in kwargs.items():
-            # try cast to numeric string to integer
-            if isinstance(val, str) and val.isdecimal() and val[0] != 0:
+        values = {}
+        for i, (key, val) in enumerate(filters.items()):
+            field, _, name = key.partition('__')
+            name = (name or op or 'eq').lower()
+            col = '{}.{}'.format(self.table_name, field)
+            param = '_{}_{}'.format(field, i)
+
+            # try cast to numeric string to integer (but keep leading zeros)
+            if isinstance(val, str) and val.isdecimal() and \
+                    (val == '0' or val[0] != '0'):
                 val = int(val)
 
-            if val is None:
-                where.append("{0}.{1} IS NULL".format(self.table_name, key))
+            if val is None and name in ('eq', 'ne', '=', '<>', '!='):
+                where.append('{} IS {}NULL'.format(
+                    col, '' if name in ('eq', '=') else 'NOT '))
+            elif name == 'in':
+                val = list(val)
+                if len(val) == 0:
+                    where.append('FALSE')
+                    continue
+                where.append(self.OPS[name].format(
+                    col=col, val='%({})s'.format(param)))
+                values[param] = val
+            elif name == 'between':
+                low, high = val
+                where.append(self.OPS[name].format(
+                    col=col, val='%({0}_low)s AND %({0}_high)s'.format(param)))
+                values[param + '_low'] = low
+                values[param + '_high'] = high
+            elif name in self.OPS:
+                where.append(self.OPS[name].format(
+                    col=col, val='%({})s'.format(param)))
+                values[param] = val
+            elif name.upper() in ('=', '<>', '!=', '<', '<=', '>', '>=',
+                                  'LIKE', 'NOT LIKE'):
+                where.append('{} {} %({})s'.format(col, name.upper(), param))
+                values[param] = val
             else:
-                where.append("{0}.{1} {2} %({1})s".format(
-                    self.table_name, key, op or ops.get(type(val), '=')))
+                self.throw('unknown operator {}'.format(name))
+
+        return ' AND '.join(where), values
 
-        return self.find(' AND '.join(where), kwargs, order_by, lock)
+    def get_many(self, values: Iterable, field: str = 'id',
+                 chunk_size: int = 1000, columns: Iterable = None) -> dict:
+        """ Finds the records with any of the values in one query per chunk
+
+        Parameters
+        ----------
+        values : Iterable
+            Values of the field to look up (duplicates are ignored)
+        field : str
+        chunk_size : int
+            Maximum number of values in one IN (...) list
+        columns : Iterable
+            Fields to select (must include field)
+
+        Returns
+        -------
+        dict
+            Mapping of field value to the record
+
+        """
+        values = list(dict.fromkeys(val for val in values if val is not None))
+        res = {}
+        for i in range(0, len(values), chunk_size):
+            for row in self.all('{0}.{1} IN %(values)s'.format(
+                    self.table_name, field),
+                    {'values': values[i:i + chunk_size]}, columns=columns):
+                res[row.get(field)] = row
+        return res
 
     def all_by_field(self, field: str, value: Any, op: str = '=',
-                     order_by: str = '') -> list:
+                     order_by: str = '', columns: Iterable = None) -> list:
         """ Finds all records by field name
 
         Parameters
@@ -66,6 +200,7 @@ class TableView(DataView):
         value : Any
         op : str
         order_by : str
+        columns : Iterable
 
         Returns
         -------
@@ -73,29 +208,34 @@ class TableView(DataView):
 
         """
         return self.all(field + op + '%(value)s', {'value': value},
-                        order_by=order_by)
+                        order_by=order_by, columns=columns)
 
-    def delete_by_id(self, item_id: int) -> int:
-        """ Deletes a row by id field
+    def delete_by_id(self, item_id: Any) -> int:
+        """ Deletes a row by its primary key
 
         Parameters
         ----------
         item_id : Any
+            Key value; a tuple (in key order) or a mapping for composite
+            primary keys
 
         Returns
         -------
         int
 
         """
-        return self.delete('id=%(item_id)s', {'item_id': item_id})
+        return self.delete(self.schema.pk_where,
+                           self.schema.pk_values(item_id))
 
-    def update_by_id(self, values: dict, item_id: int, ret: str = None) -> Any:
-        """ Updates a row by id field
+    def update_by_id(self, values: dict, item_id: Any, ret: str = None) -> Any:
+        """ Updates a row by its primary key
 
         Parameters
         ----------
         values : dict
-        item_id : int
+        item_id : Any
+            Key value; a tuple (in key order) or a mapping for composite
+            primary keys
         ret : str
 
         Returns
@@ -103,11 +243,13 @@ class TableView(DataView):
         Any
 
         """
-        return self.update(values, 'id=%(item_id)s', {'item_id': item_id}, ret)
+        return self.update(values, self.schema.pk_where,
+                           self.schema.pk_values(item_id))
 
     def select_page(self, where: str = '', values: dict = {},
                     group_by: str = '', order_by: str = '', limit: int = 10,
-                    page: int = 1, count: bool = False) -> Iterable:
+                    page: int = 1, count: bool = False,
+                    columns: Iterable = None) -> Iterable:
         """ Selects one configurable page from a table
 
         Parameters
@@ -119,6 +261,7 @@ class TableView(DataView):
         limit : int
         page : int
         count : bool
+        columns : Iterable
 
         Returns
         -------
@@ -126,7 +269,78 @@ class TableView(DataView):
 
         """
         return self.select(where, values, group_by, order_by, limit,
-                           (int(page) - 1) * int(limit), count=count).fetchall()
+                           (int(page) - 1) * int(limit), count=count,
+                           columns=columns).fetchall()
+
+    def select_after(self, where: str = '', values: dict = {},
+                     cursor: str = None, order_by: tuple = ('id',),
+                     limit: int = None, desc: bool = False,
+                     columns: Iterable = None) -> Page:
+        """ Selects one page using keyset (seek) pagination
+
+        Instead of skipping OFFSET rows the page starts right after (or
+        before) the sort keys stored in the cursor, so deep pages cost the
+        same as the first one. order_by must be unique (e.g. end with the
+        primary key).
+
+        Parameters
+        ----------
+        where : str
+        values : dict
+        cursor : str
+            Page.next or Page.prev of a previous call, None for first page
+        order_by : tuple
+            Fields to sort by
+        limit : int
+            Page size (defaults to PAGE_SIZE)
+        desc : bool
+            Sort descending
+        columns : Iterable
+
+        Returns
+        -------
+        Page
+
+        """
+        limit = int(limit or self.PAGE_SIZE)
+        direction, keys = Page.decode_cursor(cursor)
+        if keys is not None and len(keys) != len(order_by):
+            direction, keys = None, None
+        backward = direction == 'b'
+
+        names = ['{}.{}'.format(self.table_name, key) for key in order_by]
+        conditions = [where] if where else []
+        values = dict(values)
+        if keys is not None:
+            conditions.append('({}) {} ({})'.format(
+                ', '.join(names), '<' if desc != backward else '>',
+                ', '.join('%(_key{})s'.format(i) for i in range(len(keys)))))
+            values.update(('_key{}'.format(i), key)
+                          for i, key in enumerate(keys))
+        where = ' AND '.join('({})'.format(cond) for cond in conditions)
+
+        # one extra row tells if there is anything beyond this page
+        rows = self.select(where, values, '', ', '.join(
+            '{} {}'.format(name, 'DESC' if desc != backward else 'ASC')
+            for name in names), limit + 1, columns=columns).fetchall()
+        self.clear()
+
+        more = len(rows) > limit
+        rows = list(rows[:limit])
+        if backward:
+            rows.reverse()
+        if not rows:
+            return Page()
+
+        def row_keys(row):
+            return [row.get(key) for key in order_by]
+
+        first = Page.encode_cursor('b', row_keys(rows[0]))
+        last = Page.encode_cursor('a', row_keys(rows[-1]))
+        if backward:
+            return Page(rows, last, first if more else None)
+        return Page(rows, last if more else None,
+                    first if keys is not None else None)
 
     def update_order_between(self, parent_id: Any, what: int, where: int):
         """ Reorder and fix gaps in records between two order ids
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""Classes and methods to allocate per-scope sequential ids."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+from app.lib.model import Model
+
+
+class Counters(Model):
+    """ Class for defining the structure for id counters.
+
+    """
+
+    table_name = 'counters'
+    fields = {
+        'name': None,
+        'scope': None,
+        'n': None,
+    }
+    primary_key = ('name', 'scope')
+
+    def reserve(self, name: str, scope: str, count: int = 1) -> int:
+        """Method to reserve count consecutive ids, returns the first one.
+
+        A single upsert on the counter row: LAST_INSERT_ID(expr) hands the
+        new value back in the OK packet, so no MAX() scan and no extra
+        SELECT are needed and only the counter row gets locked.
+        """
+        res = self.link.execute(
+            'INSERT INTO {} (name, scope, n) VALUES '
+            '(%(name)s, %(scope)s, LAST_INSERT_ID(%(count)s)) '
+            'ON DUPLICATE KEY UPDATE n = LAST_INSERT_ID(n + %(count)s)'.format(
+                self.table_name),
+            {'name': name, 'scope': scope, 'count': count})
+        last = res.lastrowid
+        res.close()
+        return last - count + 1
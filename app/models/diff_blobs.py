@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Classes and methods to store revision diffs by content."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+from typing import Iterable, Iterator
+
+from app import app
+from app.lib.diff_store import compress, decode_chunks, digest
+from app.lib.model import Model
+
+
+class DiffBlobs(Model):
+    """ Class for defining the structure for the compressed diffs.
+
+    Blobs are addressed by the SHA-256 of the diff, so identical diffs
+    (reverts, cherry-picks, repeated imports) are stored once, and are
+    never changed or deleted.
+
+    """
+
+    table_name = 'diff_blobs'
+    fields = {
+        'hash': None,
+        'compression': None,
+        # characters of the diff and bytes of the stored data
+        'length': None,
+        'size': None,
+        'data': {'deferred': True},
+    }
+    primary_key = ('hash',)
+
+    @staticmethod
+    def method() -> str:
+        """Method to get the configured compression."""
+        return app.config.get('DIFF_COMPRESSION') or 'none'
+
+    def store(self, texts: Iterable[str]) -> list:
+        """ Store the diffs which are not stored yet
+
+        Parameters
+        ----------
+        texts : Iterable[str]
+
+        Returns
+        -------
+        list
+            The hashes of the texts, in order
+
+        """
+        texts = list(texts)
+        hashes = [digest(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        found = self.get_many(unique, 'hash', columns=('hash',))
+        method = self.method()
+        rows = []
+        for key, text in unique.items():
+            if key in found:
+                continue
+            data = compress(text, method)
+            rows.append({'hash': key, 'compression': method,
+                         'length': len(text), 'size': len(data),
+                         'data': data})
+        # chunks of a few rows: blobs can be up to megabytes each
+        self.upsert_many(rows, ('hash',), chunk_size=20)
+        return hashes
+
+    def iter_text(self, key: bytes,
+                  chunk_size: int = 256 * 1024) -> Iterator[str]:
+        """ Read and decompress the diff in chunks (of the stored data)
+
+        """
+        blob = self.get(hash=key, columns=('compression', 'size'))
+        if blob is None:
+            return
+        query = 'SELECT SUBSTRING(data, %(start)s, %(length)s) AS chunk ' \
+                'FROM {} WHERE hash=%(hash)s'.format(self.table_name)
+
+        def chunks():
+            args = {'hash': key, 'start': 1, 'length': chunk_size}
+            while args['start'] <= blob.get('size'):
+                res = self.link.execute(query, args, read_only=True)
+                row = res.fetchone()
+                res.close()
+                if not row or not row.get('chunk'):
+                    return
+                yield row.get('chunk')
+                args['start'] += chunk_size
+
+        yield from decode_chunks(chunks(), blob.get('compression'))
+
+    def load(self, key: bytes) -> str:
+        """Method to get the whole diff (in one query)."""
+        blob = self.get(hash=key, columns=('compression', 'data'))
+        if blob is None:
+            return ''
+        return ''.join(decode_chunks([blob.get('data')],
+                                     blob.get('compression')))
@@ -17,16 +17,19 @@ class Issue_comments(Model):
 
     """
 
-    def __init__(self):
-        self.table_name = 'issue_comments'
-        self.fields = {
-            'project_id': None,
-            'issue_id': None,
-            'comment_id': None,
-            'title': None,
-            'comment': None,
-            'commenter': None,
-            'date_created': {'rdonly': True},
-        }
-
-        super().__init__()
+    sequence = ('comment_id', ('project_id', 'issue_id'))
+
+    table_name = 'issue_comments'
+    fields = {
+        'project_id': None,
+        'issue_id': None,
+        'comment_id': None,
+        'title': None,
+        'comment': None,
+        'commenter': None,
+        'date_created': {'rdonly': True},
+    }
+    primary_key = ('project_id', 'issue_id', 'comment_id')
+    relations = {
+        'user': ('commenter', 'Users'),
+    }
@@ -17,15 +17,20 @@ class Issues(Model):
 
     """
 
-    def __init__(self):
-        self.table_name = 'issues'
-        self.fields = {
-            'project_id': None,
-            'issue_id': None,
-            'name': None,
-            'description': None,
-            'status': None,
-            'date_created': {'rdonly': True},
-        }
-
-        super().__init__()
+    sequence = ('issue_id', ('project_id',))
+
+    table_name = 'issues'
+    fields = {
+        'project_id': None,
+        'issue_id': None,
+        'name': None,
+        'description': None,
+        'status': None,
+        'date_created': {'rdonly': True},
+    }
+    primary_key = ('project_id', 'issue_id')
+    relations = {
+        'project': ('project_id', 'Projects'),
+    }
+    # read on every page, rarely written
+    cache_results = True
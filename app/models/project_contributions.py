@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""Classes and methods to maintain the per-project contribution counts."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+from app.lib.model import Model
+
+
+class ProjectContributions(Model):
+    """ Class for defining the structure for the contribution counts.
+
+    One row per (user, project) with the number of revisions of the user
+    in the project, changed together with the revisions (see Revisions)
+    so that the top projects of a user are read from the index instead
+    of counting the revisions on every page.
+
+    """
+
+    table_name = 'project_contributions'
+    fields = {
+        'user_id': None,
+        'project_id': None,
+        'contributions': None,
+    }
+    primary_key = ('user_id', 'project_id')
+    relations = {
+        'user': ('user_id', 'Users'),
+        'project': ('project_id', 'Projects'),
+    }
+
+    def bump(self, counts: dict):
+        """ Change the counts by the given deltas
+
+        Parameters
+        ----------
+        counts : dict
+            (user_id, project_id) -> delta
+
+        """
+        added = [{'user_id': user_id, 'project_id': project_id,
+                  'contributions': delta}
+                 for (user_id, project_id), delta in sorted(counts.items())
+                 if delta > 0]
+        removed = [{'user_id': user_id, 'project_id': project_id,
+                    'delta': -delta}
+                   for (user_id, project_id), delta in sorted(counts.items())
+                   if delta < 0]
+        if added:
+            self.link.executemany(
+                'INSERT INTO {} (user_id, project_id, contributions) '
+                'VALUES (%(user_id)s, %(project_id)s, %(contributions)s) '
+                'ON DUPLICATE KEY UPDATE contributions = contributions + '
+                'VALUES(contributions)'.format(self.table_name), added)
+        if removed:
+            self.link.executemany(
+                'UPDATE {} SET contributions = GREATEST(contributions - '
+                '%(delta)s, 0) WHERE user_id=%(user_id)s AND '
+                'project_id=%(project_id)s'.format(self.table_name), removed)
+
+    def reconcile(self, batch_size: int = 1000):
+        """ Recompute the counts from the revisions, fixing any drift
+
+        Meant to run periodically (see uwsgi.ini). Users are processed in
+        ranges of ids, one transaction each, so that the revisions are
+        never locked all at once.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of user ids per transaction
+
+        """
+        res = self.link.execute(
+            'SELECT GREATEST(COALESCE((SELECT MAX(contributor_id) FROM '
+            'revisions), 0), COALESCE((SELECT MAX(user_id) FROM {}), 0)) '
+            'AS last'.format(self.table_name))
+        last = res.fetchone()['last']
+        res.close()
+
+        for first in range(1, last + 1, batch_size):
+            values = {'first': first, 'last': first + batch_size - 1}
+            with self.link.unit_of_work():
+                self.link.execute(
+                    'INSERT INTO {} (user_id, project_id, contributions) '
+                    'SELECT contributor_id, project_id, COUNT(*) '
+                    'FROM revisions WHERE contributor_id BETWEEN '
+                    '%(first)s AND %(last)s GROUP BY contributor_id, '
+                    'project_id ON DUPLICATE KEY UPDATE contributions = '
+                    'VALUES(contributions)'.format(self.table_name),
+                    values).close()
+                self.link.execute(
+                    'DELETE FROM {0} WHERE user_id BETWEEN %(first)s AND '
+                    '%(last)s AND NOT EXISTS (SELECT 1 FROM revisions '
+                    'WHERE revisions.contributor_id = {0}.user_id AND '
+                    'revisions.project_id = {0}.project_id)'.format(
+                        self.table_name), values).close()
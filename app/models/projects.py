@@ -12,6 +12,7 @@ __status__ = "Production"
 from flask import g
 
 from app.lib.model import Model
+from app.models.user_counters import UserCounters
 
 
 class Projects(Model):
@@ -19,18 +20,17 @@ class Projects(Model):
 
     """
 
-    def __init__(self):
-        self.table_name = 'projects'
-        self.fields = {
-            'id': {'rdonly': True},
-            'name': None,
-            'description': None,
-            'owner': None,
-            'status': None,
-            'date_added': {'rdonly': True},
-        }
-
-        super().__init__()
+    table_name = 'projects'
+    fields = {
+        'id': {'rdonly': True},
+        'name': None,
+        'description': None,
+        'owner': None,
+        'status': None,
+        'date_added': {'rdonly': True},
+    }
+    # read on every page, rarely written
+    cache_results = True
 
     def create(self, name, description):
         """Method to create a new project."""
@@ -41,12 +41,22 @@ class Projects(Model):
         }
         return self.add(data)
 
+    def after_add(self, data: dict, **kwargs: dict):
+        """Keep the cached project counter of the owner up to date."""
+        if UserCounters.enabled() and data.get('owner'):
+            UserCounters().bump(data.get('owner'), 'projects')
+
     def get_top_projects(self, user_id: int, limit: int = 4, page: int = 1):
         """Get the projects with most contributions."""
-        self.attr_list.append('COUNT(*) AS count')
-        self.join('revisions', 'id=project_id', ['project_id'])
-        res = self.select_page('contributor_id=%(user_id)s',
-                               {'user_id': user_id}, group_by='id',
-                               order_by='count DESC', limit=limit, page=page)
+        # counts kept by ProjectContributions: a range of its
+        # (user_id, contributions) index instead of counting the revisions
+        self.join('project_contributions', 'id=project_id', [], 'INNER')
+        res = self.select_page(
+            'user_id=%(user_id)s AND contributions > 0',
+            {'user_id': user_id},
+            order_by='contributions DESC, project_id DESC', limit=limit,
+            page=page,
+            columns=self.schema.default_columns + ('contributions AS count',))
         self.clear()
+        self.clear_joins()
         return res
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""Classes and methods to interact with the per-file index of revisions."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+from collections import defaultdict
+from typing import Iterable
+
+from app.lib.diff_render import index_files
+from app.lib.model import Model
+
+
+class RevisionFiles(Model):
+    """ Class for defining the structure for the files of revisions.
+
+    One row per file of a revision diff, computed once when the revision
+    is added: the list pages show statistics and the diff pages read
+    single files (SUBSTRING at offset) without parsing the whole diff.
+
+    """
+
+    table_name = 'revision_files'
+    fields = {
+        'project_id': None,
+        'revision_id': None,
+        'file_no': None,
+        'path': None,
+        'status': None,
+        'additions': None,
+        'deletions': None,
+        # position of the file in the diff, in characters
+        'diff_offset': None,
+        'diff_length': None,
+    }
+    primary_key = ('project_id', 'revision_id', 'file_no')
+
+    @staticmethod
+    def index(revisions: Iterable) -> list:
+        """Method to compute the file rows of revisions with their diffs."""
+        rows = []
+        for rev in revisions:
+            for item in index_files([rev.get('diff') or '']):
+                item['project_id'] = rev.get('project_id')
+                item['revision_id'] = rev.get('revision_id')
+                item['diff_offset'] = item.pop('offset')
+                item['diff_length'] = item.pop('length')
+                rows.append(item)
+        return rows
+
+    def add_revisions(self, revisions: Iterable) -> int:
+        """Method to store the file index of revisions (idempotent)."""
+        return self.upsert_many(self.index(revisions), self.primary_key)
+
+    def get_files(self, project_id: int, revision_id: int) -> list:
+        """Method to get the index of a revision, in diff order."""
+        return self.compact().all(
+            'project_id=%(project_id)s AND revision_id=%(revision_id)s',
+            {'project_id': project_id, 'revision_id': revision_id},
+            order_by='file_no')
+
+    def with_stats(self, revisions: list, name: str = 'stats') -> list:
+        """ Attach the file count and line statistics to revisions
+
+        One query for the whole list, grouped by revision.
+
+        Parameters
+        ----------
+        revisions : list
+            Rows with project_id and revision_id
+        name : str
+            Key to store the statistics under, None for revisions without
+            an index (added before it existed)
+
+        Returns
+        -------
+        list
+            The same rows
+
+        """
+        by_project = defaultdict(set)
+        for rev in revisions:
+            by_project[rev.get('project_id')].add(rev.get('revision_id'))
+        if not by_project:
+            return revisions
+
+        where = []
+        values = {}
+        for i, (project_id, ids) in enumerate(sorted(by_project.items())):
+            where.append('(project_id=%(p{0})s AND revision_id IN %(r{0})s)'
+                         .format(i))
+            values['p{}'.format(i)] = project_id
+            values['r{}'.format(i)] = sorted(ids)
+        rows = self.all(' OR '.join(where), values,
+                        group_by='project_id, revision_id',
+                        columns=('project_id', 'revision_id',
+                                 'COUNT(*) AS files',
+                                 'SUM(additions) AS additions',
+                                 'SUM(deletions) AS deletions'))
+        stats = {(row['project_id'], row['revision_id']): row for row in rows}
+        for rev in revisions:
+            rev[name] = stats.get((rev.get('project_id'),
+                                   rev.get('revision_id')))
+        return revisions
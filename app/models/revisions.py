@@ -9,9 +9,17 @@ __license__ = 'All Rights Reserved'
 __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
+from collections import Counter
+
 from flask import g
 
+from app import app, db, diff_renderer
 from app.lib.model import Model
+from app.lib.diff_store import SequentialReader
+from app.models.diff_blobs import DiffBlobs
+from app.models.project_contributions import ProjectContributions
+from app.models.revision_files import RevisionFiles
+from app.models.user_counters import UserCounters
 
 
 class Revisions(Model):
@@ -19,16 +27,226 @@ class Revisions(Model):
 
     """
 
-    def __init__(self):
-        self.table_name = 'revisions'
-        self.fields = {
-            'project_id': None,
-            'revision_id': None,
-            'contributor_id': None,
-            'comment': None,
-            'diff': None,
-            'tag': None,
-            'date_added': {'rdonly': True},
-        }
-
-        super().__init__()
+    table_name = 'revisions'
+    fields = {
+        'project_id': None,
+        'revision_id': None,
+        'contributor_id': None,
+        'comment': None,
+        # diffs added before diff_blobs; diff_hash references the blob
+        'diff': {'deferred': True},
+        'diff_hash': {'deferred': True},
+        'tag': None,
+        'date_added': {'rdonly': True},
+    }
+    primary_key = ('project_id', 'revision_id')
+    relations = {
+        'project': ('project_id', 'Projects'),
+        'contributor': ('contributor_id', 'Users'),
+    }
+
+    def _diff_hash(self, project_id: int, revision_id: int) -> bytes:
+        rev = self.get(project_id=project_id, revision_id=revision_id,
+                       columns=('diff_hash',))
+        return rev.get('diff_hash') if rev else None
+
+    def get_diff(self, project_id: int, revision_id: int) -> str:
+        """Method to load the (deferred) diff of a revision."""
+        rev = self.get(project_id=project_id, revision_id=revision_id,
+                       columns=('diff', 'diff_hash'))
+        if rev is None:
+            return ''
+        if rev.get('diff_hash') is not None:
+            return DiffBlobs().load(rev.get('diff_hash'))
+        return rev.get('diff') or ''
+
+    def diff_length(self, project_id: int, revision_id: int) -> int:
+        """Method to get the size of the diff without loading it."""
+        res = self.link.execute(
+            'SELECT COALESCE(diff_blobs.length, CHAR_LENGTH({0}.diff)) AS '
+            'length FROM {0} LEFT JOIN diff_blobs ON diff_blobs.hash = '
+            '{0}.diff_hash WHERE {0}.project_id=%(project_id)s AND '
+            '{0}.revision_id=%(revision_id)s'.format(self.table_name),
+            {'project_id': project_id, 'revision_id': revision_id},
+            read_only=True)
+        row = res.fetchone()
+        res.close()
+        return row.get('length') or 0 if row else 0
+
+    def iter_diff(self, project_id: int, revision_id: int,
+                  chunk_size: int = 256 * 1024):
+        """Method to read the diff from the DB in chunks."""
+        key = self._diff_hash(project_id, revision_id)
+        if key is not None:
+            yield from DiffBlobs().iter_text(key, chunk_size)
+            return
+
+        # not moved to diff_blobs yet
+        query = 'SELECT SUBSTRING(diff, %(start)s, %(length)s) AS chunk ' \
+                'FROM {} WHERE project_id=%(project_id)s AND ' \
+                'revision_id=%(revision_id)s'.format(self.table_name)
+        args = {'project_id': project_id, 'revision_id': revision_id,
+                'start': 1, 'length': chunk_size}
+        while True:
+            res = self.link.execute(query, args, read_only=True)
+            row = res.fetchone()
+            res.close()
+            chunk = row.get('chunk') if row else None
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            args['start'] += len(chunk)
+
+    def diff_reader(self, project_id: int, revision_id: int,
+                    chunk_size: int = 256 * 1024):
+        """ Get a function reading parts of the diff: read(offset, length)
+
+        Compressed diffs are decompressed as a stream, so the parts must
+        be read in order of their offsets (e.g. the files of the index);
+        diffs stored inline are read with SUBSTRING.
+
+        """
+        key = self._diff_hash(project_id, revision_id)
+        if key is not None:
+            return SequentialReader(DiffBlobs().iter_text(key, chunk_size))
+        return lambda offset, length: self._diff_part(
+            project_id, revision_id, offset, length)
+
+    def _diff_part(self, project_id: int, revision_id: int, offset: int,
+                   length: int) -> str:
+        res = self.link.execute(
+            'SELECT SUBSTRING(diff, %(start)s, %(length)s) AS part FROM {} '
+            'WHERE project_id=%(project_id)s AND '
+            'revision_id=%(revision_id)s'.format(self.table_name),
+            {'project_id': project_id, 'revision_id': revision_id,
+             'start': offset + 1, 'length': length}, read_only=True)
+        row = res.fetchone()
+        res.close()
+        return row.get('part') or '' if row else ''
+
+    def diff_part(self, project_id: int, revision_id: int, offset: int,
+                  length: int) -> str:
+        """Method to read a part of the diff (e.g. a file of the index)."""
+        return self.diff_reader(project_id, revision_id)(offset, length)
+
+    def before_add_many(self, rows: list, **kwargs: dict) -> list:
+        """Store the diffs in diff_blobs, the rows reference them."""
+        with_diff = [row for row in rows if row.get('diff') is not None]
+        hashes = DiffBlobs().store(row.get('diff') for row in with_diff)
+        for row, key in zip(with_diff, hashes):
+            row['diff_hash'] = key
+        # the rows keep the text for after_add_many, the table does not
+        return [dict(row, diff=None, diff_hash=row.get('diff_hash'))
+                for row in rows]
+
+    def before_add(self, data: dict, **kwargs: dict) -> dict:
+        return self.before_add_many([data], **kwargs)[0]
+
+    def after_add(self, data: dict, **kwargs: dict):
+        """Update the counters and pre-render the diff once committed."""
+        self.after_add_many([data], **kwargs)
+        if len(data.get('diff') or '') > app.config['DIFF_STREAM_THRESHOLD']:
+            # streamed file by file when viewed, never highlighted whole
+            return
+        db.on_commit(lambda: diff_renderer.warm(
+            data.get('project_id'), data.get('revision_id'),
+            data.get('diff')))
+
+    def after_add_many(self, rows: list, **kwargs: dict):
+        """Index the files of the diffs and bump the contribution counters
+        once per contributor."""
+        RevisionFiles().add_revisions(rows)
+        ProjectContributions().bump(Counter(
+            (row.get('contributor_id'), row.get('project_id'))
+            for row in rows if row.get('contributor_id')))
+        if not UserCounters.enabled():
+            return
+        counts = Counter(row.get('contributor_id') for row in rows
+                         if row.get('contributor_id'))
+        counters = UserCounters()
+        for user_id, delta in counts.items():
+            counters.bump(user_id, 'contributions', delta)
+
+    def before_remove(self, id: tuple):
+        """Take the revision off the contribution counters."""
+        rev = self.find(self.schema.pk_where, self.schema.pk_values(id),
+                        lock=True,
+                        columns=('project_id', 'contributor_id'))
+        if rev is None or not rev.get('contributor_id'):
+            return
+        ProjectContributions().bump(
+            {(rev.get('contributor_id'), rev.get('project_id')): -1})
+        if UserCounters.enabled():
+            UserCounters().bump(rev.get('contributor_id'), 'contributions',
+                                -1)
+
+    def index_files(self, batch_size: int = 100) -> int:
+        """ Fill the file index of the revisions added before it existed
+
+        Revisions are streamed in batches with their diffs; revisions
+        that are already indexed are rewritten with the same rows, so
+        the method can be interrupted and run again.
+
+        Returns
+        -------
+        int
+            Number of revisions indexed
+
+        """
+        count = 0
+        batch = []
+        blobs = DiffBlobs()
+        for row in self.iter_rows(columns=('project_id', 'revision_id',
+                                           'diff', 'diff_hash'),
+                                  batch_size=batch_size):
+            if row.get('diff_hash') is not None:
+                row['diff'] = blobs.load(row.get('diff_hash'))
+            batch.append(row)
+            if len(batch) >= batch_size:
+                with self.link.unit_of_work():
+                    RevisionFiles().add_revisions(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with self.link.unit_of_work():
+                RevisionFiles().add_revisions(batch)
+            count += len(batch)
+        return count
+
+    def store_diffs(self, batch_size: int = 100) -> int:
+        """ Move the diffs stored inline to diff_blobs
+
+        Every batch is stored and committed on its own, the revisions
+        keep their diffs until then, so the method can be interrupted and
+        run again (already stored blobs are not written twice).
+
+        Parameters
+        ----------
+        batch_size : int
+            Revisions per transaction
+
+        Returns
+        -------
+        int
+            Number of revisions moved
+
+        """
+        query = 'UPDATE {} SET diff_hash=%(diff_hash)s, diff=NULL ' \
+                'WHERE project_id=%(project_id)s AND ' \
+                'revision_id=%(revision_id)s'.format(self.table_name)
+        count = 0
+        while True:
+            rows = self.all('diff_hash IS NULL AND diff IS NOT NULL',
+                            limit=batch_size,
+                            columns=('project_id', 'revision_id', 'diff'))
+            if not rows:
+                return count
+            with self.link.unit_of_work():
+                hashes = DiffBlobs().store(row.get('diff') for row in rows)
+                self.link.executemany(query, [
+                    {'project_id': row.get('project_id'),
+                     'revision_id': row.get('revision_id'),
+                     'diff_hash': key} for row, key in zip(rows, hashes)])
+            count += len(rows)
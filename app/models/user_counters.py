@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""Classes and methods to maintain cached per-user counters."""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+from app import app
+from app.lib.model import Model
+
+
+class UserCounters(Model):
+    """ Class for defining the structure for user counters.
+
+    """
+
+    counters = ('projects', 'contributions')
+
+    table_name = 'user_counters'
+    fields = {
+        'user_id': None,
+        'projects': None,
+        'contributions': None,
+    }
+    primary_key = ('user_id',)
+    relations = {
+        'user': ('user_id', 'Users'),
+    }
+
+    @staticmethod
+    def enabled() -> bool:
+        """Method to check if the counters are maintained."""
+        return bool(app.config.get('USER_COUNTERS'))
+
+    def bump(self, user_id: int, counter: str, delta: int = 1):
+        """Method to change a counter of the user by delta."""
+        if counter not in self.counters:
+            self.throw('unknown counter {}'.format(counter))
+
+        self.link.execute(
+            'INSERT INTO {0} (user_id, {1}) VALUES (%(user_id)s, '
+            'GREATEST(%(delta)s, 0)) ON DUPLICATE KEY UPDATE '
+            '{1} = GREATEST({1} + %(delta)s, 0)'.format(self.table_name,
+                                                        counter),
+            {'user_id': user_id, 'delta': delta}).close()
+
+    def get_counts(self, user_id: int) -> dict:
+        """Method to get all the counters of the user."""
+        row = self.get(user_id=user_id)
+        return {key: row.get(key) if row else 0 for key in self.counters}
+
+    def reconcile(self):
+        """Method to recompute the counters from the source tables."""
+        self.link.execute(
+            'INSERT INTO {} (user_id, projects, contributions) '
+            'SELECT users.id, '
+            '(SELECT COUNT(*) FROM projects WHERE owner = users.id), '
+            '(SELECT COUNT(*) FROM revisions '
+            'WHERE contributor_id = users.id) FROM users '
+            'ON DUPLICATE KEY UPDATE projects = VALUES(projects), '
+            'contributions = VALUES(contributions)'.format(self.table_name)
+        ).close()
@@ -10,47 +10,101 @@ __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
 import re
-import hashlib
 from functools import wraps
 from flask import g, redirect, url_for, session
 
-from app import app
+from app import db, passwords, user_cache
+from app.lib.passwords import PasswordBusy
 from app.lib.model import Model
 
 
+class UserPrincipal(object):
+    """ Slim, cacheable representation of the logged in user.
+
+    """
+    __slots__ = ('id', 'first_name', 'second_name', 'email')
+
+    def __init__(self, id: int, first_name: str, second_name: str,
+                 email: str):
+        self.id = id
+        self.first_name = first_name
+        self.second_name = second_name
+        self.email = email
+
+    def get(self, key: str, default=None):
+        """Dict-like access for the templates."""
+        return getattr(self, key, default)
+
+
 class Users(Model):
     """ Class for defining the structure for users.
 
     """
 
-    def __init__(self):
-        self.table_name = 'users'
-        self.fields = {
-            'id': {'rdonly': True},
-            'first_name': None,
-            'second_name': None,
-            'email': None,
-            'password': None,
-            'date_registered': {'rdonly': True},
-        }
+    # bumped on writes that can not be tied to a user id, so that every
+    # cached principal of this worker becomes unreachable
+    cache_generation = 0
 
-        self.id = ''
-        self.first_name = ''
-        self.second_name = ''
-        self.email = ''
+    table_name = 'users'
+    fields = {
+        'id': {'rdonly': True},
+        'first_name': None,
+        'second_name': None,
+        'email': None,
+        'password': None,
+        'date_registered': {'rdonly': True},
+    }
 
-        super().__init__()
+    @classmethod
+    def _cache_key(cls, user_id) -> str:
+        return 'user:{}:{}'.format(cls.cache_generation, user_id)
 
     def get_user_by_id(self, user_id):
-        """Method to get user by id"""
-        user = self.get(id=user_id)
-        if user:
-            self.id = user.get('id')
-            self.first_name = user.get('first_name')
-            self.second_name = user.get('second_name')
-            self.email = user.get('email')
-            
-        return self
+        """Method to get user by id (served from the user cache)"""
+        key = self._cache_key(user_id)
+        if user_cache is not None:
+            user = user_cache.get(key)
+            if user is not None:
+                return user
+
+        row = self.get(id=user_id, columns=UserPrincipal.__slots__)
+        if not row:
+            return None
+        user = UserPrincipal(*(row.get(field)
+                               for field in UserPrincipal.__slots__))
+        if user_cache is not None:
+            user_cache.set(key, user)
+        return user
+
+    def invalidate(self, user_id=None):
+        """Method to drop cached users after a write."""
+        if user_cache is None:
+            return
+
+        def drop():
+            if user_id is None:
+                Users.cache_generation += 1
+            else:
+                user_cache.delete(self._cache_key(user_id))
+
+        drop()
+        # once more after commit, a concurrent request could have cached
+        # the old row in between
+        db.on_commit(drop)
+
+    def update(self, values: dict, where=True, condition: dict = {}):
+        """Update users, invalidating their cached principals."""
+        res = super().update(values, where, condition)
+        if res:
+            self.invalidate(condition.get('_pk_id', condition.get('id')))
+        return res
+
+    def delete(self, where=True, values: dict = {}) -> int:
+        """Delete users, invalidating their cached principals."""
+        res = super().delete(where, values)
+        if res:
+            self.invalidate(values.get('_pk_id', values.get('id')))
+        return res
 
     def login_user(self, email: str, pwd: str):
         """Method to log a user in."""
@@ -58,12 +112,19 @@ class Users(Model):
             return 'wrong email format'
         
         user = self.get(email=email)
-        if not user:
-            return 'wrong login credentials'
-
-        pwd = self._pwd_hash(email, pwd)
-        if pwd != user.get('password'):
-            return 'wrong login credentials'
+        try:
+            if not user:
+                # as slow as a registered email: the time tells nothing
+                passwords.verify(passwords.dummy, pwd)
+                return 'wrong login credentials'
+            if not passwords.verify(user.get('password'), pwd, email):
+                return 'wrong login credentials'
+            if passwords.needs_rehash(user.get('password')):
+                # upgrade legacy/weaker hashes while we know the password
+                self.update_by_id({'password': passwords.hash(pwd)},
+                                  user.get('id'))
+        except PasswordBusy:
+            return 'too many login attempts, please try again later'
 
         session['user_id'] = user.get('id')
 
@@ -84,11 +145,9 @@ class Users(Model):
         return pwd_regex.match(pwd)
 
     @staticmethod
-    def _pwd_hash(email: str, pwd: str):
+    def _pwd_hash(pwd: str):
         """Method to generate hash for a password"""
-        salt = app.config['SALT']
-        return hashlib.sha256('{0}!{1}*{2}'.format(
-            email, pwd, salt).encode('utf-8')).hexdigest()
+        return passwords.hash(pwd)
 
 
 def req_user_login():
@@ -9,20 +9,21 @@ __license__ = 'All Rights Reserved'
 __maintainer__ = 'hharutyunyan'
 __status__ = "Production"
 
-from flask import Blueprint, render_template, request, session, redirect, \
-    url_for, g
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
-from pygments.styles import get_style_by_name
+import csv
+import io
 
+from flask import Blueprint, render_template, request, session, redirect, \
+    url_for, g, stream_template, Response, stream_with_context, abort
 from app.models.users import Users, req_user_login
 from app.models.issues import Issues
 from app.models.projects import Projects
 from app.models.revisions import Revisions
+from app.models.revision_files import RevisionFiles
 from app.models.issue_comments import Issue_comments
+from app.models.user_counters import UserCounters
 
-from app import db
+from app import app, db, diff_renderer, metrics
+from app.lib.diff_render import iter_files
 
 routes = Blueprint('routes', __name__, )
 
@@ -31,14 +32,15 @@ routes = Blueprint('routes', __name__, )
 @req_user_login()
 def home():
     """Render home page."""
-    counts = {
-        'projects': Projects().select(
-            'owner=%(user_id)s', {'user_id': g.user.id}
-        ).rowcount,
-        'contributions': Revisions().select(
-            'contributor_id=%(user_id)s', {'user_id': g.user.id}
-        ).rowcount
-    }
+    if UserCounters.enabled():
+        counts = UserCounters().get_counts(g.user.id)
+    else:
+        counts = {
+            'projects': Projects().count(
+                'owner=%(user_id)s', {'user_id': g.user.id}),
+            'contributions': Revisions().count(
+                'contributor_id=%(user_id)s', {'user_id': g.user.id})
+        }
 
     top_projects = Projects().get_top_projects(g.user.id)
     return render_template('home.html', counts=counts,
@@ -94,10 +96,46 @@ def projects():
 def project(project_id):
     """Page with the list of all projects."""
     project = Projects().get(id=project_id)
-    revisions = Revisions().all_by_field('project_id', project_id)
-    issues = Issues().all_by_field('project_id', project_id)
+    where = 'project_id=%(project_id)s'
+    values = {'project_id': project_id}
+    revisions = Revisions().compact().select_after(
+        where, values, request.args.get('rev'), order_by=('revision_id',),
+        limit=app.config['PAGE_SIZE'], desc=True)
+    issues = Issues().compact().select_after(
+        where, values, request.args.get('iss'), order_by=('issue_id',),
+        limit=app.config['PAGE_SIZE'], desc=True)
+    RevisionFiles().with_stats(revisions)
+    counts = {
+        'revisions': Revisions().count(where, values),
+        'issues': Issues().count(where, values)
+    }
     return render_template('project.html', revisions=revisions, project=project,
-                           issues=issues)
+                           issues=issues, counts=counts)
+
+
+@routes.route('/projects/<project_id>/revisions.csv')
+@req_user_login()
+def export_revisions(project_id):
+    """Revision history of the project as CSV, streamed row by row."""
+    columns = ('revision_id', 'contributor_id', 'comment', 'tag',
+               'date_added')
+    rows = Revisions().compact().iter_rows(
+        'project_id=%(project_id)s', {'project_id': project_id},
+        order_by='revision_id', columns=columns)
+
+    def generate():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename='
+                             'revisions-{}.csv'.format(project_id)})
 
 
 @routes.route('/projects/<project_id>/rev/<revision_id>')
@@ -106,33 +144,76 @@ def revision(project_id, revision_id):
     """Page with the list of all projects."""
     project = Projects().get(id=project_id)
     revision = Revisions().get(project_id=project_id, revision_id=revision_id)
-    diff = revision.get('diff')
-    lexer = get_lexer_by_name("diff", stripall=True)
-    formatter = HtmlFormatter(style=get_style_by_name('colorful'))
-    formatted_diff = highlight(diff, lexer, formatter)
     user = Users().get(id=revision.get('contributor_id'))
+    formatted_diff = diff_renderer.cached(revision.get('project_id'),
+                                          revision.get('revision_id'))
+
+    if formatted_diff is None and Revisions().diff_length(
+            project_id, revision_id) > app.config['DIFF_STREAM_THRESHOLD']:
+        # too big to render in one go: highlight and send file by file
+        def fragment_url(file_no):
+            return url_for('routes.revision_file', project_id=project_id,
+                           revision_id=revision_id, file_no=file_no)
+
+        files = RevisionFiles().get_files(project_id, revision_id)
+        if files:
+            # files in order: a compressed diff is decompressed only once
+            diff = diff_renderer.stream_indexed(
+                files, Revisions().diff_reader(
+                    project_id, revision_id, app.config['DIFF_STREAM_CHUNK']),
+                fragment_url, app.config['DIFF_LAZY_FILE_SIZE'],
+                app.config['DIFF_STREAM_CHUNK'])
+        else:
+            chunks = Revisions().iter_diff(project_id, revision_id,
+                                           app.config['DIFF_STREAM_CHUNK'])
+            diff = diff_renderer.stream(chunks, fragment_url,
+                                        app.config['DIFF_LAZY_FILE_SIZE'])
+        return stream_template('revision.html', revision=revision,
+                               project=project, user=user, diff=diff,
+                               diff_styles=diff_renderer.stylesheet())
+
+    if formatted_diff is None:
+        formatted_diff = diff_renderer.render(
+            revision.get('project_id'), revision.get('revision_id'),
+            lambda: Revisions().get_diff(project_id, revision_id))
     return render_template('revision.html', revision=revision, project=project,
-                           user=user, diff=formatted_diff,
-                           diff_styles=HtmlFormatter().get_style_defs(
-                               '.highlight'))
+                           user=user, diff=[formatted_diff],
+                           diff_styles=diff_renderer.stylesheet())
+
+
+@routes.route('/projects/<project_id>/rev/<revision_id>/file/<int:file_no>')
+@req_user_login()
+def revision_file(project_id, revision_id, file_no):
+    """Render one file of a revision diff (collapsed files)."""
+    item = RevisionFiles().get(project_id=project_id, revision_id=revision_id,
+                               file_no=file_no)
+    if item is not None:
+        return diff_renderer.highlight(Revisions().diff_part(
+            project_id, revision_id, item.get('diff_offset'),
+            item.get('diff_length')))
+
+    # revision not indexed (yet): find the file in the diff
+    chunks = Revisions().iter_diff(project_id, revision_id,
+                                   app.config['DIFF_STREAM_CHUNK'])
+    for no, (_, text) in enumerate(iter_files(chunks)):
+        if no == file_no:
+            return diff_renderer.highlight(text)
+    return '', 404
 
 
 @routes.route('/projects/<project_id>/issue/<issue_id>',
               methods=['GET', 'POST'])
 @req_user_login()
+@db.transactional()
 def issue(project_id, issue_id):
     """Return the list of issues."""
     project = Projects().get(id=project_id)
     issue = Issues().get(project_id=project_id, issue_id=issue_id)
 
     if request.method == 'POST':
-        new_comment_id = db.execute(
-            'SELECT new_issue_comment_id({}, {}) AS id;'.format(
-                project_id, issue_id)).fetchone()
         form = {
             'project_id': project_id,
             'issue_id': issue_id,
-            'comment_id': new_comment_id.get('id'),
             'title': request.form.get('title'),
             'comment': request.form.get('comment'),
             'commenter': g.user.id
@@ -141,39 +222,39 @@ def issue(project_id, issue_id):
 
     if request.args.get('resolve'):
         Issues().update({'status': 'resolved'},
-                        where='project_id={} AND issue_id={}'.format(
-                            project_id, issue_id))
+                        'project_id=%(project_id)s AND issue_id=%(issue_id)s',
+                        {'project_id': project_id, 'issue_id': issue_id})
         return redirect(
             url_for('routes.issue', issue_id=issue_id, project_id=project_id))
     if request.args.get('close'):
         Issues().update({'status': 'closed'},
-                        where='project_id={} AND issue_id={}'.format(
-                            project_id, issue_id))
+                        'project_id=%(project_id)s AND issue_id=%(issue_id)s',
+                        {'project_id': project_id, 'issue_id': issue_id})
         return redirect(
             url_for('routes.issue', issue_id=issue_id, project_id=project_id))
 
-    comments = Issue_comments().all(
-        'issue_id=%(issue_id)s AND project_id=%(project_id)s',
-        {'issue_id': issue_id, 'project_id': project_id}
-    )
-    for comment in comments:
-        comment['user'] = Users().get(id=comment.get('commenter'))
+    where = 'issue_id=%(issue_id)s AND project_id=%(project_id)s'
+    values = {'issue_id': issue_id, 'project_id': project_id}
+    comments = Issue_comments().compact().select_after(
+        where, values, request.args.get('page'), order_by=('comment_id',),
+        limit=app.config['PAGE_SIZE'])
+    Issue_comments().with_related(comments, 'user',
+                                  columns=('id', 'first_name', 'second_name'))
+    comments_count = Issue_comments().count(where, values)
     return render_template('issues.html', project=project, issue=issue,
-                           comments=comments)
+                           comments=comments, comments_count=comments_count)
 
 
 @routes.route('/projects/<project_id>/issue/new', methods=['GET', 'POST'])
 @req_user_login()
+@db.transactional()
 def create_issue(project_id):
     """Page with the list of all projects."""
     project = Projects().get(id=project_id)
 
     if request.method == 'POST':
-        new_issue_id = db.execute(
-            'SELECT new_issue_id({}) AS id;'.format(project_id)).fetchone()
         form = {
             'project_id': project_id,
-            'issue_id': new_issue_id.get('id'),
             'name': request.form.get('name'),
             'description': request.form.get('description')
         }
@@ -208,7 +289,23 @@ def create_project():
 @req_user_login()
 def contributions():
     """Page to list user's contributions."""
-    contributions = Revisions().all_by_field('contributor_id', g.user.id)
-    for cont in contributions:
-        cont['project'] = Projects().get(id=cont.get('project_id'))
+    contributions = Revisions().compact().select_after(
+        'contributor_id=%(user_id)s', {'user_id': g.user.id},
+        request.args.get('page'),
+        order_by=('date_added', 'project_id', 'revision_id'),
+        limit=app.config['PAGE_SIZE'], desc=True)
+    Revisions().with_related(contributions, 'project')
+    RevisionFiles().with_stats(contributions)
     return render_template('contributions.html', contributions=contributions)
+
+
+@routes.route('/metrics')
+def metrics_page():
+    """Metrics of all workers in the Prometheus text format."""
+    if metrics is None:
+        abort(404)
+    allow = app.config.get('METRICS_ALLOW')
+    if allow and request.remote_addr not in allow:
+        abort(403)
+    return Response(metrics.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
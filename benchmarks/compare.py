@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Compare two result files of benchmarks/run.py.
+
+Usage: python -m benchmarks.compare base.json new.json [--metric p50_ms]
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import json
+import argparse
+
+
+def compare(base: dict, new: dict, metric: str = 'p50_ms') -> list:
+    """ (case, base value, new value, ratio) of the cases of both runs
+
+    """
+    rows = []
+    for name in sorted(set(base['results']) & set(new['results'])):
+        old = base['results'][name][metric]
+        cur = new['results'][name][metric]
+        rows.append((name, old, cur, cur / old if old else float('inf')))
+    return rows
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='p50_ms',
+                        help='p50_ms, p90_ms, p99_ms, mean_ms, queries, '
+                             'peak_kib, ...')
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    for key in ('backend', 'seed', 'scale'):
+        if base['meta'].get(key) != new['meta'].get(key):
+            print('warning: different {} ({} / {})'.format(
+                key, base['meta'].get(key), new['meta'].get(key)))
+
+    print('{:<28} {:>12} {:>12} {:>8}'.format('case', base['meta'].get('git'),
+                                              new['meta'].get('git'), 'ratio'))
+    for name, old, cur, ratio in compare(base, new, args.metric):
+        print('{:<28} {:12.3f} {:12.3f} {:7.2f}x'.format(name, old, cur,
+                                                          ratio))
+
+
+if __name__ == '__main__':
+    main()
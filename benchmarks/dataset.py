@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""Seeded generator of a synthetic SCHub dataset.
+
+Follows database.sql: users, projects, contributors, revisions with
+unified diffs of realistic (log-normal) sizes, issues and their comments.
+The same seed and scale always produce the same rows.
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import random
+from typing import Iterator
+
+from app.lib.data_view import DataView
+
+PASSWORD = 'Benchmark-Passw0rd'
+
+# children first, so that the foreign keys allow emptying them in order
+TABLES = ('issue_comments', 'issues', 'revision_files', 'revisions',
+          'diff_blobs', 'project_contributions', 'contributors', 'projects',
+          'user_counters', 'users', 'counters')
+
+_WORDS = ('alpha', 'buffer', 'cache', 'delta', 'event', 'field', 'graph',
+          'handler', 'index', 'join', 'key', 'list', 'model', 'node',
+          'offset', 'parser', 'query', 'record', 'state', 'token', 'update',
+          'value', 'worker', 'config', 'session', 'request', 'response')
+_EXTENSIONS = ('py', 'py', 'py', 'js', 'html', 'css', 'sql', 'md')
+_STATEMENTS = ('{a} = {b}({c})', 'return {a}.{b}', 'if {a} is None:',
+               'for {a} in {b}:', '{a}.{b}({c}, {d})', 'self.{a} = {b}',
+               '# {a} the {b} of {c}', 'raise {A}Error("{b} {c}")',
+               'def {a}_{b}(self, {c}):', 'import {a}.{b}')
+
+
+class Contributors(DataView):
+    """ The contributors table, which has no model of its own """
+    table_name = 'contributors'
+    fields = {
+        'project_id': None,
+        'user_id': None,
+        'permissions': None,
+    }
+    primary_key = ('project_id', 'user_id')
+
+
+class Dataset(object):
+    """ Rows of a synthetic dataset
+
+    Parameters
+    ----------
+    seed : int
+    scale : float
+        Multiplies the number of users and projects (and so of the rows of
+        the other tables); 1.0 gives 200 users, 40 projects, ~1600
+        revisions, 400 issues and ~2000 comments
+
+    """
+    users = 200
+    projects = 40
+    contributors_per_project = 6
+    revisions_per_project = 40
+    issues_per_project = 10
+    comments_per_issue = 5
+    # log-normal size of the diffs (lines): median ~90, long tail of huge
+    # generated / vendored changes
+    diff_lines_mu = 4.5
+    diff_lines_sigma = 1.2
+    diff_lines_max = 60000
+
+    def __init__(self, seed: int = 42, scale: float = 1.0):
+        self.seed = seed
+        self.scale = scale
+        self.n_users = max(2, int(self.users * scale))
+        self.n_projects = max(1, int(self.projects * scale))
+
+        super().__init__()
+
+    def _random(self, table: str) -> random.Random:
+        # one generator per table, so tables do not shift each other
+        return random.Random('{}:{}'.format(self.seed, table))
+
+    @staticmethod
+    def _words(rnd: random.Random, low: int, high: int) -> str:
+        return ' '.join(rnd.choice(_WORDS) for _ in range(
+            rnd.randint(low, high)))
+
+    def gen_users(self, password_hash: str) -> Iterator[dict]:
+        """ Users, ids 1..n_users in order; all share the same password
+
+        """
+        rnd = self._random('users')
+        for i in range(1, self.n_users + 1):
+            yield {
+                'first_name': rnd.choice(_WORDS).title(),
+                'second_name': rnd.choice(_WORDS).title(),
+                'email': 'user{}@bench.example.com'.format(i),
+                'password': password_hash,
+            }
+
+    def gen_projects(self) -> Iterator[dict]:
+        """ Projects, ids 1..n_projects; user 1 owns every fourth one
+
+        """
+        rnd = self._random('projects')
+        for i in range(1, self.n_projects + 1):
+            yield {
+                'name': '{}-{}'.format(rnd.choice(_WORDS), i),
+                'description': self._words(rnd, 5, 30),
+                'owner': 1 if i % 4 == 1 else rnd.randint(2, self.n_users),
+            }
+
+    def project_members(self, project_id: int) -> list:
+        """ Users contributing to the project (user 1 to most of them)
+
+        """
+        rnd = self._random('members:{}'.format(project_id))
+        members = set(rnd.sample(range(2, self.n_users + 1), min(
+            self.n_users - 1, self.contributors_per_project)))
+        if project_id % 4 != 0:
+            members.add(1)
+        return sorted(members)
+
+    def gen_contributors(self) -> Iterator[dict]:
+        for project_id in range(1, self.n_projects + 1):
+            for user_id in self.project_members(project_id):
+                yield {'project_id': project_id, 'user_id': user_id,
+                       'permissions': 'write'}
+
+    def diff(self, rnd: random.Random) -> str:
+        """ A unified diff of a log-normal number of lines over a few files
+
+        """
+        lines = min(self.diff_lines_max, max(4, int(rnd.lognormvariate(
+            self.diff_lines_mu, self.diff_lines_sigma))))
+        files = max(1, min(40, int(rnd.expovariate(1 / 3)) + 1,
+                           lines // 4))
+        out = []
+        for f in range(files):
+            path = '{}/{}_{}.{}'.format(rnd.choice(_WORDS), rnd.choice(
+                _WORDS), f, rnd.choice(_EXTENSIONS))
+            out.append('diff --git a/{0} b/{0}\n--- a/{0}\n+++ b/{0}\n'.format(
+                path))
+            remaining = lines // files
+            start = rnd.randint(1, 500)
+            while remaining > 0:
+                size = min(remaining, rnd.randint(3, 40))
+                remaining -= size
+                body = []
+                old = new = 0
+                for _ in range(size):
+                    kind = rnd.choice(' +-  +')
+                    line = rnd.choice(_STATEMENTS).format(
+                        a=rnd.choice(_WORDS), b=rnd.choice(_WORDS),
+                        c=rnd.choice(_WORDS), d=rnd.choice(_WORDS),
+                        A=rnd.choice(_WORDS).title())
+                    body.append('{}    {}\n'.format(kind, line))
+                    old += kind != '+'
+                    new += kind != '-'
+                out.append('@@ -{},{} +{},{} @@\n'.format(start, old, start,
+                                                         new))
+                out.extend(body)
+                start += size + rnd.randint(5, 80)
+        return ''.join(out)
+
+    def gen_revisions(self) -> Iterator[dict]:
+        rnd = self._random('revisions')
+        for project_id in range(1, self.n_projects + 1):
+            members = self.project_members(project_id)
+            count = max(1, int(rnd.gauss(self.revisions_per_project,
+                                         self.revisions_per_project / 3)))
+            for revision_id in range(1, count + 1):
+                yield {
+                    'project_id': project_id,
+                    'revision_id': revision_id,
+                    'contributor_id': rnd.choice(members),
+                    'comment': self._words(rnd, 3, 12),
+                    'diff': self.diff(rnd),
+                    'tag': 'v{}'.format(revision_id // 10)
+                    if revision_id % 10 == 0 else None,
+                }
+
+    def gen_issues(self) -> Iterator[dict]:
+        rnd = self._random('issues')
+        for project_id in range(1, self.n_projects + 1):
+            for issue_id in range(1, self.issues_per_project + 1):
+                yield {
+                    'project_id': project_id,
+                    'issue_id': issue_id,
+                    'name': self._words(rnd, 2, 6),
+                    'description': self._words(rnd, 10, 80),
+                    'status': rnd.choice(('new', 'new', 'resolved',
+                                          'closed')),
+                }
+
+    def gen_comments(self) -> Iterator[dict]:
+        rnd = self._random('comments')
+        for project_id in range(1, self.n_projects + 1):
+            members = self.project_members(project_id)
+            for issue_id in range(1, self.issues_per_project + 1):
+                count = int(rnd.expovariate(1 / self.comments_per_issue))
+                for comment_id in range(1, count + 1):
+                    yield {
+                        'project_id': project_id,
+                        'issue_id': issue_id,
+                        'comment_id': comment_id,
+                        'title': self._words(rnd, 1, 5),
+                        'comment': self._words(rnd, 5, 60),
+                        'commenter': rnd.choice(members),
+                    }
+
+    def load(self, password_hash: str) -> dict:
+        """ Insert the dataset through the models
+
+        The tables must be empty, so that the auto increment ids of the
+        users and projects are 1..n. The sequences of the issues and
+        comments are set past the generated ids.
+
+        Returns
+        -------
+        dict
+            Number of rows per table
+
+        """
+        from app import db
+        from app.models.users import Users
+        from app.models.projects import Projects
+        from app.models.revisions import Revisions
+        from app.models.issues import Issues
+        from app.models.issue_comments import Issue_comments
+        from app.models.counters import Counters
+        from app.models.user_counters import UserCounters
+        issues = list(self.gen_issues())
+        comments = list(self.gen_comments())
+        sequences = {}
+        for row in issues:
+            sequences[('issues', str(row['project_id']))] = row['issue_id']
+        for row in comments:
+            sequences[('issue_comments', '{}:{}'.format(
+                row['project_id'], row['issue_id']))] = row['comment_id']
+
+        counts = {}
+        with db.unit_of_work():
+            counts['users'] = Users().insert_many(
+                self.gen_users(password_hash))
+            counts['projects'] = Projects().insert_many(self.gen_projects())
+            counts['contributors'] = Contributors().insert_many(
+                self.gen_contributors())
+            # big diffs: keep the statements well under max_allowed_packet
+            counts['revisions'] = Revisions().add_many(
+                self.gen_revisions(), chunk_size=50)
+            counts['issues'] = Issues().insert_many(issues)
+            counts['issue_comments'] = Issue_comments().insert_many(comments)
+            Counters().upsert_many(
+                ({'name': name, 'scope': scope, 'n': n}
+                 for (name, scope), n in sequences.items()),
+                ('name', 'scope'))
+            if UserCounters.enabled():
+                UserCounters().reconcile()
+        return counts
+
+
+def reset():
+    """ Empty every table of the dataset (for a dedicated benchmark DB!)
+
+    """
+    from app import db
+    for table in TABLES:
+        # TRUNCATE is refused on tables referenced by foreign keys
+        db.execute('DELETE FROM {}'.format(table)).close()
+    for table in ('users', 'projects'):
+        db.execute('ALTER TABLE {} AUTO_INCREMENT = 1'.format(table)).close()
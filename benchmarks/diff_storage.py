@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Compare the storage size and read latency of the diff layouts.
+
+The diffs of the synthetic dataset (with a share of duplicates, as left
+by reverts and cherry-picks) are stored inline in revisions.diff, as
+before diff_blobs, and then as blobs with every compression method.
+
+Usage: python -m benchmarks.diff_storage [--seed N] [--scale X]
+                                         [--duplicates 0.1] [--repeat N]
+                                         [--output results.json]
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+from benchmarks.run import Bench, git_revision
+
+LAYOUTS = ('inline', 'none', 'zlib', 'lzma')
+
+
+def store(db, texts: dict, layout: str) -> dict:
+    """ Store the diffs with the layout, return the size of the storage
+
+    Parameters
+    ----------
+    db : DB
+    texts : dict
+        (project_id, revision_id) -> diff
+    layout : str
+        'inline' or a compression method of diff_blobs
+
+    Returns
+    -------
+    dict
+        Bytes of the stored diffs, number of blobs and seconds spent
+
+    """
+    from app import app
+    from app.models.diff_blobs import DiffBlobs
+    from app.models.revisions import Revisions
+
+    with db.unit_of_work():
+        for (project_id, revision_id), text in texts.items():
+            db.execute('UPDATE revisions SET diff=%(diff)s, diff_hash=NULL '
+                       'WHERE project_id=%(project_id)s AND '
+                       'revision_id=%(revision_id)s',
+                       {'diff': text, 'project_id': project_id,
+                        'revision_id': revision_id}).close()
+        db.execute('DELETE FROM diff_blobs').close()
+    db.release()
+
+    start = time.perf_counter()
+    if layout == 'inline':
+        size = sum(len(text.encode('utf-8')) for text in texts.values())
+        blobs = 0
+    else:
+        app.config['DIFF_COMPRESSION'] = layout
+        Revisions().store_diffs()
+        row = DiffBlobs().select(columns=('COUNT(*) AS blobs',
+                                          'SUM(size) AS size')).fetchone()
+        size, blobs = int(row['size'] or 0), row['blobs']
+    elapsed = time.perf_counter() - start
+    db.release()
+    return {'bytes': size, 'blobs': blobs, 'store_seconds': elapsed}
+
+
+def read_cases(texts: dict) -> list:
+    """ (name, function) reading a median and the biggest diff
+
+    """
+    from app.models.revisions import Revisions
+    from app.models.revision_files import RevisionFiles
+
+    sizes = sorted((len(text), key) for key, text in texts.items())
+    cases = []
+    for size_name, (_, (project_id, revision_id)) in (
+            ('small', sizes[len(sizes) // 2]), ('big', sizes[-1])):
+        files = RevisionFiles().get_files(project_id, revision_id)
+        last = files[-1] if files else {'diff_offset': 0, 'diff_length': 0}
+
+        def get_diff(p=project_id, r=revision_id):
+            Revisions().get_diff(p, r)
+
+        def iter_diff(p=project_id, r=revision_id):
+            for _ in Revisions().iter_diff(p, r):
+                pass
+
+        # the worst case of the collapsed files: the last one of the diff
+        def last_file(p=project_id, r=revision_id, item=last):
+            Revisions().diff_part(p, r, item['diff_offset'],
+                                  item['diff_length'])
+
+        cases += [('get_diff_' + size_name, get_diff),
+                  ('iter_diff_' + size_name, iter_diff),
+                  ('last_file_' + size_name, last_file)]
+    return cases
+
+
+def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scale', type=float, default=0.5)
+    parser.add_argument('--duplicates', type=float, default=0.1,
+                        help='share of revisions repeating another diff')
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--output', help='JSON file of the results')
+    args = parser.parse_args(argv)
+
+    from app import app, db
+    from app.models.revisions import Revisions
+    from benchmarks import dataset, standin
+
+    standin.install(db)
+    db.release()
+    counts = dataset.Dataset(args.seed, args.scale).load('x')
+    db.release()
+
+    with app.app_context():
+        texts = {(row['project_id'], row['revision_id']):
+                 Revisions().get_diff(row['project_id'], row['revision_id'])
+                 for row in Revisions().all(columns=('project_id',
+                                                     'revision_id'))}
+        rnd = random.Random(args.seed)
+        keys = sorted(texts)
+        for key in rnd.sample(keys, int(len(keys) * args.duplicates)):
+            texts[key] = texts[rnd.choice(keys)]
+        db.release()
+
+    bench = Bench(db, args.repeat)
+    storage = {}
+    for layout in LAYOUTS:
+        with app.app_context():
+            storage[layout] = store(db, texts, layout)
+            print('{:<7} {:>12,} bytes {:>6} blobs {:7.2f} s'.format(
+                layout, storage[layout]['bytes'], storage[layout]['blobs'],
+                storage[layout]['store_seconds']), file=sys.stderr)
+            for name, case in read_cases(texts):
+                bench.run('{}_{}'.format(layout, name), case)
+            db.release()
+
+    report = {
+        'meta': {
+            'backend': 'standin',
+            'seed': args.seed,
+            'scale': args.scale,
+            'duplicates': args.duplicates,
+            'repeat': args.repeat,
+            'rows': counts,
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'storage': storage,
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    return report
+
+
+if __name__ == '__main__':
+    main()
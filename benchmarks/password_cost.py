@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""Measure password hashing cost to pick PASSWORD_PARAMS.
+
+Usage: python -m benchmarks.password_cost [target_seconds]
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import sys
+import time
+import statistics
+
+from app.lib.passwords import PasswordHasher, calibrate
+
+
+def measure(algorithm: str, params: dict, rounds: int = 5) -> float:
+    """Median seconds of one hash with the given parameters."""
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        PasswordHasher.derive(algorithm, params, 'benchmark', b'0' * 16)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(target: float = 0.25):
+    for algorithm, key, values in (
+            ('scrypt', 'n', [2 ** i for i in range(12, 18)]),
+            ('pbkdf2_sha256', 'iterations',
+             [100000, 200000, 400000, 600000, 1000000])):
+        print(algorithm)
+        for value in values:
+            params = dict(PasswordHasher.defaults[algorithm], **{key: value})
+            print('  {}={:<8} {:8.1f} ms'.format(
+                key, value, measure(algorithm, params) * 1000))
+        print('  suggested for {:.0f} ms: {}'.format(
+            target * 1000, calibrate(algorithm, target)))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.25)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""Compare the memory of dict rows and compact Record rows.
+
+Rows are built the way the cursors build them (from the tuples received
+from the server), shaped like a page of revisions.
+
+Usage: python -m benchmarks.row_memory [rows]
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import sys
+import time
+import datetime
+import tracemalloc
+
+from app.lib.records import record_class
+
+FIELDS = ('project_id', 'revision_id', 'contributor_id', 'comment', 'tag',
+          'date_added')
+
+
+def server_rows(count: int) -> list:
+    """Tuples as received from the server."""
+    now = datetime.datetime(2018, 1, 1)
+    return [(1, i, i % 100, 'Revision {}'.format(i), None, now)
+            for i in range(count)]
+
+
+def measure(build, raw: list) -> tuple:
+    """Peak bytes allocated and seconds spent building the rows."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = [build(row) for row in raw]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return peak, elapsed
+
+
+def main(count: int = 100000):
+    raw = server_rows(count)
+    record = record_class(FIELDS)
+    print('{:,} rows of {} columns'.format(count, len(FIELDS)))
+    results = {}
+    for name, build in (('dict', lambda row: dict(zip(FIELDS, row))),
+                        ('record', record)):
+        peak, elapsed = results[name] = measure(build, raw)
+        print('  {:<7} {:>10,.0f} KiB {:>7.0f} B/row {:>8.1f} ms'.format(
+            name, peak / 1024, peak / count, elapsed * 1000))
+    print('  record/dict memory: {:.0%}'.format(
+        results['record'][0] / results['dict'][0]))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""Benchmark the routes and the data layer on a synthetic dataset.
+
+Usage: python -m benchmarks.run [--seed N] [--scale X] [--repeat N]
+                                [--output results.json] [--mysql --reset]
+
+By default the application runs against an in-process SQLite stand-in
+(benchmarks/standin.py), so no database server or network is needed.
+With --mysql the database of config.py is used; it must be a dedicated,
+empty database (--reset empties it first). Compare two result files
+with benchmarks/compare.py.
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import subprocess
+from typing import Callable
+
+
+def percentile(values: list, pct: float) -> float:
+    """ Nearest-rank percentile of sorted values """
+    index = max(0, min(len(values) - 1,
+                       int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class Bench(object):
+    """ Runs the cases and collects their statistics
+
+    Every case is run warmup times first, then repeat times timed (with
+    the number of statements counted through DB.hooks) and finally a few
+    times under tracemalloc for the peak memory, which would otherwise
+    distort the timings.
+
+    Parameters
+    ----------
+    db : DB
+    repeat : int
+    warmup : int
+    memory_rounds : int
+
+    """
+
+    def __init__(self, db, repeat: int = 50, warmup: int = 3,
+                 memory_rounds: int = 3):
+        self.db = db
+        self.repeat = repeat
+        self.warmup = warmup
+        self.memory_rounds = memory_rounds
+        self.results = {}
+        self._queries = 0
+        db.hooks.append(self._count)
+
+        super().__init__()
+
+    def _count(self, query: str, duration: float, rows: int):
+        self._queries += 1
+
+    def run(self, name: str, case: Callable, repeat: int = None):
+        """ Measure case() and store its statistics under name
+
+        """
+        repeat = repeat or self.repeat
+        for _ in range(self.warmup):
+            case()
+
+        times = []
+        self._queries = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            case()
+            times.append(time.perf_counter() - start)
+        queries = self._queries / repeat
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(self.memory_rounds):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            case()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+        times.sort()
+        self.results[name] = {
+            'n': repeat,
+            'p50_ms': percentile(times, 50) * 1000,
+            'p90_ms': percentile(times, 90) * 1000,
+            'p99_ms': percentile(times, 99) * 1000,
+            'mean_ms': sum(times) / repeat * 1000,
+            'min_ms': times[0] * 1000,
+            'max_ms': times[-1] * 1000,
+            'queries': queries,
+            'peak_kib': peak / 1024,
+        }
+        print('{:<28} p50 {p50_ms:9.3f} ms  p99 {p99_ms:9.3f} ms  '
+              '{queries:5.1f} q  {peak_kib:9.1f} KiB'.format(
+                  name, **self.results[name]), file=sys.stderr)
+
+
+def route_cases(app, db, dataset) -> list:
+    """ (name, request function, repeat factor) for every route
+
+    The requests are made by user 1, who owns and contributes to most of
+    the projects. POST cases add rows, so later runs see a few more.
+
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    from app.models.revisions import Revisions
+    sizes = sorted((Revisions().diff_length(row['project_id'],
+                                            row['revision_id']),
+                    row['project_id'], row['revision_id'])
+                   for row in Revisions().all(
+                       'project_id=%(project_id)s', {'project_id': 1},
+                       columns=('project_id', 'revision_id')))
+    _, p_small, r_small = sizes[len(sizes) // 2]
+    _, p_big, r_big = sizes[-1]
+    db.release()
+
+    def get(url: str, client=client) -> Callable:
+        def case():
+            res = client.get(url)
+            res.get_data()
+            if res.status_code >= 400:
+                raise Exception('{} returned {}'.format(url, res.status_code))
+        return case
+
+    def post(url: str, data: dict, client=client) -> Callable:
+        def case():
+            res = client.post(url, data=data)
+            if res.status_code >= 400:
+                raise Exception('{} returned {}'.format(url, res.status_code))
+        return case
+
+    def login():
+        # a new client every time, a logged in one would be logged out
+        res = app.test_client().post('/login/', data={
+            'email': 'user2@bench.example.com', 'password': dataset.PASSWORD})
+        if res.status_code != 302:
+            raise Exception('login failed')
+
+    next_page = client.get('/projects/1').get_data(as_text=True)
+    cursor = next_page.split('?rev=', 1)[1].split('"', 1)[0] \
+        if '?rev=' in next_page else ''
+
+    return [
+        ('route:home', get('/'), 1),
+        ('route:projects', get('/projects/'), 1),
+        ('route:project', get('/projects/1'), 1),
+        ('route:project_page2', get('/projects/1?rev=' + cursor), 1),
+        ('route:export_revisions', get('/projects/1/revisions.csv'), 1),
+        ('route:revision', get('/projects/{}/rev/{}'.format(
+            p_small, r_small)), 1),
+        ('route:revision_big', get('/projects/{}/rev/{}'.format(
+            p_big, r_big)), 0.2),
+        ('route:revision_file', get('/projects/{}/rev/{}/file/1'.format(
+            p_big, r_big)), 1),
+        ('route:issue', get('/projects/1/issue/1'), 1),
+        ('route:issue_comment', post('/projects/1/issue/2', {
+            'title': 'benchmark', 'comment': 'benchmark comment'}), 0.5),
+        ('route:create_issue', post('/projects/1/issue/new', {
+            'name': 'benchmark', 'description': 'benchmark issue'}), 0.5),
+        ('route:create_project', post('/projects/new/', {
+            'name': 'benchmark', 'description': 'benchmark project'}), 0.5),
+        ('route:contributions', get('/contributions/'), 1),
+        ('route:account', get('/account/'), 1),
+        ('route:login', login, 0.1),
+        ('route:metrics', get('/metrics'), 1),
+    ]
+
+
+def primitive_cases(db) -> list:
+    """ (name, function, repeat factor) for the DataView/TableView calls
+
+    Every call releases the connection afterwards, like a request does.
+
+    """
+    from app.models.users import Users
+    from app.models.projects import Projects
+    from app.models.revisions import Revisions
+    from app.models.counters import Counters
+
+    def released(f: Callable) -> Callable:
+        def case():
+            try:
+                f()
+            finally:
+                db.release()
+        return case
+
+    project = {'project_id': 1}
+    columns = ('project_id', 'revision_id', 'contributor_id', 'comment',
+               'date_added')
+    state = {'n': 0}
+
+    def insert_many():
+        state['n'] += 1
+        Counters().insert_many({'name': 'benchmark', 'scope': '{}:{}'.format(
+            state['n'], i), 'n': i} for i in range(500))
+
+    def upsert_many():
+        Counters().upsert_many(({'name': 'benchmark-upsert', 'scope': str(i),
+                                 'n': i} for i in range(500)),
+                               ('name', 'scope'))
+
+    def with_related():
+        rows = Revisions().compact().select(
+            'project_id=%(project_id)s', project, columns=columns)
+        Revisions().with_related(rows, 'project')
+
+    cases = [
+        ('select', lambda: Revisions().select(
+            'project_id=%(project_id)s', project, columns=columns), 1),
+        ('select_compact', lambda: Revisions().compact().select(
+            'project_id=%(project_id)s', project, columns=columns), 1),
+        ('find', lambda: Projects().find('id=%(id)s', {'id': 1}), 1),
+        ('all', lambda: Revisions().all(
+            'project_id=%(project_id)s', project, columns=columns), 1),
+        ('get', lambda: Projects().get(id=1), 1),
+        ('get_uncached', lambda: Projects().cached(False).get(id=1), 1),
+        ('get_many', lambda: Users().get_many(range(1, 101)), 1),
+        ('select_after', lambda: Revisions().select_after(
+            'project_id=%(project_id)s', project, None,
+            order_by=('revision_id',), limit=10, desc=True), 1),
+        ('count', lambda: Revisions().count(
+            'project_id=%(project_id)s', project), 1),
+        ('iter_rows', lambda: sum(1 for _ in Revisions().iter_rows(
+            'project_id=%(project_id)s', project, columns=columns,
+            batch_size=10)), 1),
+        ('with_related', with_related, 1),
+        ('insert_many_500', insert_many, 0.2),
+        ('upsert_many_500', upsert_many, 0.2),
+    ]
+    return [('primitive:' + name, released(f), factor)
+            for name, f, factor in cases]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--mysql', action='store_true',
+                        help='use the database of config.py')
+    parser.add_argument('--reset', action='store_true',
+                        help='empty the tables of the MySQL database first')
+    parser.add_argument('--only', default='',
+                        help='run the cases whose name contains this')
+    args = parser.parse_args(argv)
+
+    from app import app, db, passwords
+    from benchmarks import dataset, standin
+
+    if args.mysql:
+        from app.models.users import Users
+        if args.reset:
+            dataset.reset()
+        elif Users().count():
+            parser.error('the database is not empty, use --reset to empty '
+                         'it (all its data is lost!)')
+        backend = 'mysql'
+    else:
+        standin.install(db)
+        backend = 'standin'
+    db.release()
+
+    data = dataset.Dataset(args.seed, args.scale)
+    start = time.perf_counter()
+    counts = data.load(passwords.hash(dataset.PASSWORD))
+    load_time = time.perf_counter() - start
+    db.release()
+    print('dataset {} in {:.1f} s'.format(counts, load_time), file=sys.stderr)
+
+    bench = Bench(db, args.repeat, args.warmup)
+    with app.app_context():
+        cases = primitive_cases(db)
+    cases += route_cases(app, db, dataset)
+    for name, case, factor in cases:
+        if args.only in name:
+            with app.app_context():
+                bench.run(name, case, max(1, int(args.repeat * factor)))
+
+    report = {
+        'meta': {
+            'backend': backend,
+            'seed': args.seed,
+            'scale': args.scale,
+            'repeat': args.repeat,
+            'rows': counts,
+            'load_seconds': load_time,
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+"""In-process SQLite stand-in for the MySQL server.
+
+Implements the part of the PyMySQL connection/cursor interface used by
+app.lib.db, translating the MySQL dialect used by the models to SQLite,
+so that the benchmarks run without a database server or network. Timings
+are only comparable between runs on the same backend.
+"""
+
+__version__ = '0.0.1'
+__author__ = 'hharutyunyan'
+__copyright__ = 'Copyright 2018, hharutyunyan'
+__license__ = 'All Rights Reserved'
+__maintainer__ = 'hharutyunyan'
+__status__ = "Production"
+
+import re
+import sqlite3
+import threading
+
+# mirrors database.sql (and the migrations), in the SQLite dialect
+SCHEMA = """
+CREATE TABLE users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT NOT NULL,
+  second_name TEXT NOT NULL, email TEXT NOT NULL UNIQUE,
+  password TEXT NOT NULL, date_registered TEXT DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE projects (
+  id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT,
+  owner INTEGER NOT NULL, status TEXT DEFAULT 'active',
+  date_added TEXT DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE contributors (
+  project_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+  permissions TEXT DEFAULT 'read', PRIMARY KEY (project_id, user_id));
+CREATE TABLE diff_blobs (
+  hash BLOB PRIMARY KEY, compression TEXT NOT NULL DEFAULT 'none',
+  length INTEGER NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL);
+CREATE TABLE revisions (
+  project_id INTEGER, revision_id INTEGER NOT NULL, contributor_id INTEGER,
+  comment TEXT NOT NULL, diff TEXT, diff_hash BLOB, tag TEXT,
+  date_added TEXT DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (project_id, revision_id));
+CREATE INDEX revisions_contributor ON revisions (contributor_id, date_added);
+CREATE TABLE revision_files (
+  project_id INTEGER NOT NULL, revision_id INTEGER NOT NULL,
+  file_no INTEGER NOT NULL, path TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'modified',
+  additions INTEGER NOT NULL DEFAULT 0, deletions INTEGER NOT NULL DEFAULT 0,
+  diff_offset INTEGER NOT NULL, diff_length INTEGER NOT NULL,
+  PRIMARY KEY (project_id, revision_id, file_no));
+CREATE TABLE project_contributions (
+  user_id INTEGER NOT NULL, project_id INTEGER NOT NULL,
+  contributions INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, project_id));
+CREATE INDEX project_contributions_top
+  ON project_contributions (user_id, contributions, project_id);
+CREATE TABLE issues (
+  project_id INTEGER, issue_id INTEGER, name TEXT NOT NULL, description TEXT,
+  status TEXT DEFAULT 'new', date_created TEXT DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (project_id, issue_id));
+CREATE TABLE issue_comments (
+  project_id INTEGER, issue_id INTEGER, comment_id INTEGER,
+  title TEXT NOT NULL, comment TEXT, commenter INTEGER,
+  date_created TEXT DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (project_id, issue_id, comment_id));
+CREATE INDEX issue_comments_commenter ON issue_comments (commenter);
+CREATE TABLE user_counters (
+  user_id INTEGER PRIMARY KEY, projects INTEGER NOT NULL DEFAULT 0,
+  contributions INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE counters (
+  name TEXT NOT NULL, scope TEXT NOT NULL, n INTEGER NOT NULL,
+  PRIMARY KEY (name, scope));
+"""
+
+_PARAM = re.compile(r"%\((\w+)\)s|%s|%%")
+_REWRITES = (
+    (re.compile(r'\bFOR UPDATE\b'), ''),
+    (re.compile(r'\bGREATEST\('), 'MAX('),
+    (re.compile(r'\bLEAST\('), 'MIN('),
+    (re.compile(r'\bCHAR_LENGTH\('), 'LENGTH('),
+    (re.compile(r'\bNOW\(\)'), 'CURRENT_TIMESTAMP'),
+    (re.compile(r'\bVALUES\((\w+)\)'), r'excluded.\1'),
+    (re.compile(r'\bON DUPLICATE KEY UPDATE\b'), 'ON CONFLICT DO UPDATE SET'),
+)
+
+
+def translate(query: str, args) -> tuple:
+    """ MySQL statement with PyMySQL placeholders -> SQLite statement
+
+    Lists and tuples are expanded for IN (...) like PyMySQL does.
+
+    """
+    params = {}
+    position = [0]
+    args = args if args is not None else {}
+
+    def param(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1) is not None:
+            name, value = match.group(1), args[match.group(1)]
+        else:
+            name, value = 'p{}'.format(position[0]), args[position[0]]
+            position[0] += 1
+        if isinstance(value, (list, tuple, set, frozenset)):
+            names = []
+            for i, item in enumerate(value):
+                params['{}_{}'.format(name, i)] = item
+                names.append(':{}_{}'.format(name, i))
+            return '(' + ', '.join(names or ['NULL']) + ')'
+        params[name] = value
+        return ':' + name
+
+    sql = _PARAM.sub(param, query)
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql, params
+
+
+class Server(object):
+    """ The shared in-memory database all stand-in connections talk to
+
+    """
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False,
+                                  isolation_level=None)
+        self.lock = threading.RLock()
+        self.last_insert_id = None
+        self.db.create_function('LAST_INSERT_ID', 1, self._last_insert_id)
+        self.db.create_collation('utf8mb4_bin',
+                                 lambda a, b: (a > b) - (a < b))
+        self.db.executescript(SCHEMA)
+
+        super().__init__()
+
+    def _last_insert_id(self, value):
+        self.last_insert_id = value
+        return value
+
+    def connect(self, *args, **kwargs) -> 'Connection':
+        return Connection(self)
+
+
+class Cursor(object):
+    """ Buffered cursor; rows are dicts unless a Record cursor is asked for
+
+    """
+
+    def __init__(self, conn: 'Connection', cls: type = None):
+        self.conn = conn
+        self.cls = cls
+        self.rowcount = -1
+        self.lastrowid = None
+        self.description = None
+        self.max_stmt_length = 1024000
+        self._rows = []
+
+    def _build(self, names: tuple):
+        if self.cls is not None and hasattr(self.cls, '_record_fields'):
+            from app.lib.records import record_class
+            return record_class(names)
+        return lambda row: dict(zip(names, row))
+
+    def execute(self, query: str, args=None) -> int:
+        if query.lstrip().upper().startswith('SELECT @@MAX_ALLOWED_PACKET'):
+            self._rows = [{'size': 64 * 1024 * 1024}]
+            return 1
+        sql, params = translate(query, args)
+        server = self.conn.server
+        with server.lock:
+            server.last_insert_id = None
+            try:
+                cur = server.db.execute(sql, params)
+            except sqlite3.Error as ex:
+                raise _error(ex)
+            self.description = cur.description
+            if cur.description:
+                build = self._build(tuple(d[0] for d in cur.description))
+                self._rows = [build(row) for row in cur.fetchall()]
+                self.rowcount = len(self._rows)
+            else:
+                self._rows = []
+                self.rowcount = cur.rowcount
+            self.lastrowid = server.last_insert_id \
+                if server.last_insert_id is not None else cur.lastrowid
+        return self.rowcount
+
+    def executemany(self, query: str, seq) -> int:
+        total = 0
+        for args in seq:
+            self.execute(query, args)
+            total += self.rowcount
+        self.rowcount = total
+        return total
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size: int = 1) -> list:
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self) -> list:
+        rows, self._rows = self._rows, []
+        return rows
+
+    def __iter__(self):
+        while self._rows:
+            yield self._rows.pop(0)
+
+    def close(self):
+        self._rows = []
+
+
+def _error(ex: sqlite3.Error) -> Exception:
+    import pymysql.err
+    if isinstance(ex, sqlite3.IntegrityError):
+        return pymysql.err.IntegrityError(1062, str(ex))
+    return pymysql.err.ProgrammingError(1064, str(ex))
+
+
+class Connection(object):
+    """ PyMySQL-like connection to the stand-in server
+
+    """
+    open = True
+
+    def __init__(self, server: Server):
+        self.server = server
+
+    def cursor(self, cls: type = None) -> Cursor:
+        return Cursor(self, cls)
+
+    def begin(self):
+        with self.server.lock:
+            if not self.server.db.in_transaction:
+                self.server.db.execute('BEGIN')
+
+    def commit(self):
+        with self.server.lock:
+            if self.server.db.in_transaction:
+                self.server.db.commit()
+
+    def rollback(self):
+        with self.server.lock:
+            if self.server.db.in_transaction:
+                self.server.db.rollback()
+
+    def ping(self, reconnect: bool = False):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def install(db) -> Server:
+    """ Point the DB object (primary and replicas) at a fresh stand-in
+
+    Parameters
+    ----------
+    db : app.lib.db.DB
+
+    Returns
+    -------
+    Server
+
+    """
+    server = Server()
+    db.release(discard=True)
+    db.pool.dispose()
+    db.pool.connect = server.connect
+    db.connect = server.connect
+    for replica in db.replicas:
+        replica.pool.dispose()
+    db._max_packet = None
+    return server
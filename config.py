@@ -21,5 +21,98 @@ DB_NAME = 'SCHub'
 DB_USER = 'root'
 DB_PWD = '123456'
 
+# connection pool (per uWSGI worker)
+DB_POOL_SIZE = 5
+DB_POOL_MAX_OVERFLOW = 5
+DB_POOL_TIMEOUT = 10
+DB_POOL_RECYCLE = 3600
+DB_POOL_IDLE_TIMEOUT = 300
+DB_POOL_PING_INTERVAL = 30
+
+# read replicas ("host" or "host:port", same credentials as the primary).
+# Reads go to a replica picked 'round_robin' or by 'least_connections'
+# (the Threads_connected of the servers, read by the health checks),
+# except inside transactions and after the request wrote anything; replicas
+# lagging more than DB_REPLICA_MAX_LAG seconds or unreachable are skipped
+# until the next check, DB_REPLICA_CHECK_INTERVAL seconds later.
+DB_REPLICAS = []
+DB_REPLICA_STRATEGY = 'round_robin'
+DB_REPLICA_MAX_LAG = 5
+DB_REPLICA_CHECK_INTERVAL = 10
+
+# query instrumentation: statements slower than SLOW_QUERY_MS are logged
+# (to SLOW_QUERY_LOG, or the application log when None), SELECTs repeated
+# N_PLUS_ONE times within a request are reported as N+1 patterns; per
+# request totals are sent in the Server-Timing header
+QUERY_LOG = True
+SLOW_QUERY_MS = 200
+SLOW_QUERY_LOG = None
+N_PLUS_ONE = 10
+
+# Prometheus metrics at /metrics, aggregated over the uWSGI workers through
+# one file per worker in METRICS_DIR; only clients in METRICS_ALLOW (None:
+# anyone) may read them
+METRICS = True
+METRICS_DIR = '/tmp/schub/metrics'
+METRICS_ALLOW = ('127.0.0.1',)
+
+# serve dashboard counters from the user_counters table (created by
+# migrations/006_user_counters.sql; run UserCounters().reconcile() once
+# after enabling)
+USER_COUNTERS = False
+
+# cache of the logged in user: 'memory', 'disk', 'tiered' or None; entries
+# live USER_CACHE_TTL seconds at most, which also bounds how long other
+# workers may see a user that was just changed
+USER_CACHE = 'memory'
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 30
+USER_CACHE_DIR = '/tmp/schub/users'
+
+# results of the models with cache_results (see DataView.cached):
+# 'memory', 'tiered' (memory + disk shared by the workers) or None. Entries
+# are dropped when a table they read is written; QUERY_CACHE_VERSIONS is
+# the file of the table versions shared by the workers (None keeps them in
+# the process, only for a single worker). The TTL bounds the life of
+# entries made stale by writes from outside the application.
+QUERY_CACHE = 'memory'
+QUERY_CACHE_SIZE = 32 * 1024 * 1024
+QUERY_CACHE_TTL = 300
+QUERY_CACHE_DIR = '/tmp/schub/queries'
+QUERY_CACHE_VERSIONS = '/tmp/schub/table_versions'
+
+# rows per page of the revision, issue and comment lists
+PAGE_SIZE = 50
+
+# rendered diff cache: 'memory', 'disk', 'tiered' (memory + disk) or None
+DIFF_STYLE = 'colorful'
+DIFF_CACHE = 'memory'
+DIFF_CACHE_SIZE = 64 * 1024 * 1024
+DIFF_CACHE_DIR = '/tmp/schub/diffs'
+
+# diffs longer than this (characters) are streamed file by file, files
+# longer than DIFF_LAZY_FILE_SIZE are collapsed and loaded on demand
+DIFF_STREAM_THRESHOLD = 1024 * 1024
+DIFF_STREAM_CHUNK = 256 * 1024
+DIFF_LAZY_FILE_SIZE = 256 * 1024
+
+# compression of new diffs in diff_blobs: 'zlib', 'lzma' (smaller, slower
+# to write and read) or 'none'; stored blobs keep their own compression.
+# Compare them with benchmarks/diff_storage.py
+DIFF_COMPRESSION = 'zlib'
+
+# password hashing: 'scrypt' (n, r, p) or 'pbkdf2_sha256' (iterations);
+# pick the cost with benchmarks/password_cost.py. Hashes are computed by
+# PASSWORD_WORKERS threads per worker, with at most PASSWORD_MAX_PENDING
+# running over all the workers (slots shared through lock files in
+# PASSWORD_SLOTS_DIR), further logins are turned away at once.
+PASSWORD_ALGORITHM = 'scrypt'
+PASSWORD_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+PASSWORD_WORKERS = 2
+PASSWORD_MAX_PENDING = 8
+PASSWORD_TIMEOUT = 10
+PASSWORD_SLOTS_DIR = '/tmp/schub/password_slots'
+
+# global salt of the legacy SHA-256 password hashes (migrated on login)
 SALT = 'Bm8&`Chq#6U.;=mkNCuzkq%H=yYFD~6]e,|{H*]~-|*0P-$h7za&a9GySY6%w!5s'
 SECRET_KEY = 'J%pakLL&O.ruP7pL6S-$KaB-(G%G/T9XM[D~fbw+d+vNy9*x.0->}<FqTsUHdJYz'
\ No newline at end of file
@@ -26,7 +26,8 @@ CREATE TABLE `users`
   `email`           varchar(255) NOT NULL,
   `password`        varchar(255) NOT NULL,
   `date_registered` datetime DEFAULT CURRENT_TIMESTAMP,
-  PRIMARY KEY (id)
+  PRIMARY KEY (id),
+  UNIQUE KEY `users_email` (`email`)
 ) ENGINE = InnoDB;
 
 
@@ -82,6 +83,19 @@ CREATE TABLE `tests`
 ) ENGINE = InnoDB;
 
 
+-- --------------------------------------------------------
+-- Creating the table to store the diffs, compressed and by content
+CREATE TABLE diff_blobs
+(
+  hash        BINARY(32)  NOT NULL,
+  compression ENUM ('none', 'zlib', 'lzma') NOT NULL DEFAULT 'none',
+  length      INTEGER     NOT NULL,
+  size        INTEGER     NOT NULL,
+  data        LONGBLOB    NOT NULL,
+  PRIMARY KEY (hash)
+);
+
+
 -- --------------------------------------------------------
 -- Creating the table to store revision
 CREATE TABLE revisions
@@ -90,14 +104,55 @@ CREATE TABLE revisions
   revision_id    INTEGER      NOT NULL,
   contributor_id INTEGER,
   comment        TEXT         NOT NULL,
-  diff           TEXT         NOT NULL,
+  diff           TEXT         NULL,
+  diff_hash      BINARY(32)   NULL,
   tag            VARCHAR(255) NULL,
   date_added     DATETIME DEFAULT NOW(),
   PRIMARY KEY (project_id, revision_id),
+  KEY revisions_contributor (contributor_id, date_added),
   FOREIGN KEY (project_id) REFERENCES projects (id)
     ON DELETE CASCADE
     ON UPDATE CASCADE,
-  FOREIGN KEY (contributor_id) REFERENCES users (id)
+  FOREIGN KEY (contributor_id) REFERENCES users (id),
+  FOREIGN KEY (diff_hash) REFERENCES diff_blobs (hash)
+);
+
+
+-- --------------------------------------------------------
+-- Creating table for the per-file index of the revision diffs
+CREATE TABLE revision_files
+(
+  project_id  INTEGER       NOT NULL,
+  revision_id INTEGER       NOT NULL,
+  file_no     INTEGER       NOT NULL,
+  path        VARCHAR(1024) NOT NULL,
+  status      ENUM ('added', 'deleted', 'modified', 'renamed', 'binary')
+                            NOT NULL DEFAULT 'modified',
+  additions   INTEGER       NOT NULL DEFAULT 0,
+  deletions   INTEGER       NOT NULL DEFAULT 0,
+  diff_offset INTEGER       NOT NULL,
+  diff_length INTEGER       NOT NULL,
+  PRIMARY KEY (project_id, revision_id, file_no),
+  FOREIGN KEY (project_id, revision_id)
+    REFERENCES revisions (project_id, revision_id)
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+
+-- --------------------------------------------------------
+-- Creating table for the number of revisions of every user per project
+CREATE TABLE project_contributions
+(
+  user_id       INTEGER NOT NULL,
+  project_id    INTEGER NOT NULL,
+  contributions INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, project_id),
+  KEY project_contributions_top (user_id, contributions, project_id),
+  FOREIGN KEY (user_id) REFERENCES users (id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (project_id) REFERENCES projects (id)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
 );
 
 
@@ -147,6 +202,7 @@ CREATE TABLE issue_comments
   commenter    INTEGER,
   date_created DATETIME DEFAULT NOW(),
   PRIMARY KEY (project_id, issue_id, comment_id),
+  KEY issue_comments_commenter (commenter),
   FOREIGN KEY (project_id, issue_id)
     REFERENCES issues (project_id, issue_id)
     ON DELETE CASCADE ON UPDATE CASCADE,
@@ -157,33 +213,26 @@ CREATE TABLE issue_comments
 
 
 -- --------------------------------------------------------
-  -- Creating a function to return the last issue id
-CREATE FUNCTION new_issue_id(proj_id INTEGER)
-  RETURNS INTEGER DETERMINISTIC
-BEGIN
-  DECLARE last_id INTEGER;
-
-  SET last_id = (SELECT MAX(issue_id)
-                 FROM issues
-                 WHERE project_id = proj_id
-                 GROUP BY project_id) + 1;
-
-  RETURN last_id;
-END;
+-- Creating table for cached per-user dashboard counters
+CREATE TABLE user_counters
+(
+  user_id       INTEGER NOT NULL,
+  projects      INTEGER NOT NULL DEFAULT 0,
+  contributions INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id),
+  FOREIGN KEY (user_id)
+    REFERENCES users (id)
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
 
 
 -- --------------------------------------------------------
-  -- Creating a function to return the last issue comment id
-CREATE FUNCTION new_issue_comment_id(proj_id INTEGER, iss_id INTEGER)
-  RETURNS INTEGER DETERMINISTIC
-BEGIN
-  DECLARE last_id INTEGER;
-
-  SET last_id = (SELECT MAX(issue_id)
-                 FROM issue_comments
-                 WHERE project_id = proj_id
-                   AND issue_id = iss_id
-                 GROUP BY project_id) + 1;
-
-  RETURN last_id;
-END;
\ No newline at end of file
+-- Creating table for per-scope id counters (issue ids per project,
+-- comment ids per issue), see Model.sequence
+CREATE TABLE counters
+(
+  name  VARCHAR(64) NOT NULL,
+  scope VARCHAR(64) NOT NULL,
+  n     INTEGER     NOT NULL,
+  PRIMARY KEY (name, scope)
+) ENGINE = InnoDB;
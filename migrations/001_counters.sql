@@ -0,0 +1,29 @@
+-- Replaces the new_issue_id()/new_issue_comment_id() functions with the
+-- counters table used by Model.sequence
+-- version: 1.1.0
+
+USE `SCHub`;
+
+CREATE TABLE IF NOT EXISTS counters
+(
+  name  VARCHAR(64) NOT NULL,
+  scope VARCHAR(64) NOT NULL,
+  n     INTEGER     NOT NULL,
+  PRIMARY KEY (name, scope)
+) ENGINE = InnoDB;
+
+-- seed the counters from the existing rows
+INSERT INTO counters (name, scope, n)
+SELECT 'issues', CAST(project_id AS CHAR), MAX(issue_id)
+FROM issues
+GROUP BY project_id
+ON DUPLICATE KEY UPDATE n = GREATEST(n, VALUES(n));
+
+INSERT INTO counters (name, scope, n)
+SELECT 'issue_comments', CONCAT(project_id, ':', issue_id), MAX(comment_id)
+FROM issue_comments
+GROUP BY project_id, issue_id
+ON DUPLICATE KEY UPDATE n = GREATEST(n, VALUES(n));
+
+DROP FUNCTION IF EXISTS new_issue_id;
+DROP FUNCTION IF EXISTS new_issue_comment_id;
@@ -0,0 +1,17 @@
+-- Indexes backing the equality lookups of TableView.get and the
+-- contribution listing
+-- version: 1.1.0
+
+USE `SCHub`;
+
+-- login looks users up by email; fails if duplicate emails exist
+ALTER TABLE users
+  ADD UNIQUE KEY users_email (email);
+
+-- contributions are listed per contributor, newest first; replaces the
+-- index InnoDB created implicitly for the foreign key
+ALTER TABLE revisions
+  ADD KEY revisions_contributor (contributor_id, date_added);
+
+ALTER TABLE issue_comments
+  ADD KEY issue_comments_commenter (commenter);
@@ -0,0 +1,28 @@
+-- Per-file index of the revision diffs (path, status, line counts and
+-- position in the diff), filled by Revisions when revisions are added
+-- version: 1.2.0
+
+USE `SCHub`;
+
+CREATE TABLE IF NOT EXISTS revision_files
+(
+  project_id  INTEGER       NOT NULL,
+  revision_id INTEGER       NOT NULL,
+  file_no     INTEGER       NOT NULL,
+  path        VARCHAR(1024) NOT NULL,
+  status      ENUM ('added', 'deleted', 'modified', 'renamed', 'binary')
+                            NOT NULL DEFAULT 'modified',
+  additions   INTEGER       NOT NULL DEFAULT 0,
+  deletions   INTEGER       NOT NULL DEFAULT 0,
+  diff_offset INTEGER       NOT NULL,
+  diff_length INTEGER       NOT NULL,
+  PRIMARY KEY (project_id, revision_id, file_no),
+  FOREIGN KEY (project_id, revision_id)
+    REFERENCES revisions (project_id, revision_id)
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- the existing revisions are indexed by parsing their diffs, which SQL
+-- can not do; run once after the migration (safe to re-run):
+--   python -c "from app.models.revisions import Revisions; \
+--              print(Revisions().index_files())"
@@ -0,0 +1,25 @@
+-- Diffs stored once per content (SHA-256), compressed, in diff_blobs;
+-- revisions reference them by hash and keep the inline diff until moved
+-- version: 1.3.0
+
+USE `SCHub`;
+
+CREATE TABLE IF NOT EXISTS diff_blobs
+(
+  hash        BINARY(32)  NOT NULL,
+  compression ENUM ('none', 'zlib', 'lzma') NOT NULL DEFAULT 'none',
+  length      INTEGER     NOT NULL,
+  size        INTEGER     NOT NULL,
+  data        LONGBLOB    NOT NULL,
+  PRIMARY KEY (hash)
+);
+
+ALTER TABLE revisions
+  MODIFY diff TEXT NULL,
+  ADD COLUMN diff_hash BINARY(32) NULL AFTER diff,
+  ADD FOREIGN KEY (diff_hash) REFERENCES diff_blobs (hash);
+
+-- the existing diffs are hashed and compressed in Python, in batches of
+-- one transaction each; run once after the migration (safe to re-run):
+--   python -c "from app.models.revisions import Revisions; \
+--              print(Revisions().store_diffs())"
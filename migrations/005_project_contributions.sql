@@ -0,0 +1,28 @@
+-- Number of revisions of every user per project, kept up to date by
+-- Revisions and read by Projects.get_top_projects
+-- version: 1.3.0
+
+USE `SCHub`;
+
+CREATE TABLE IF NOT EXISTS project_contributions
+(
+  user_id       INTEGER NOT NULL,
+  project_id    INTEGER NOT NULL,
+  contributions INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, project_id),
+  KEY project_contributions_top (user_id, contributions, project_id),
+  FOREIGN KEY (user_id) REFERENCES users (id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (project_id) REFERENCES projects (id)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+);
+
+-- seed the counts from the existing revisions (the periodic
+-- ProjectContributions().reconcile() corrects them later on)
+INSERT INTO project_contributions (user_id, project_id, contributions)
+SELECT contributor_id, project_id, COUNT(*)
+FROM revisions
+WHERE contributor_id IS NOT NULL
+GROUP BY contributor_id, project_id
+ON DUPLICATE KEY UPDATE contributions = VALUES(contributions);
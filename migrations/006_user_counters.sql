@@ -0,0 +1,27 @@
+-- Cached per-user dashboard counters, maintained by Projects and
+-- Revisions when USER_COUNTERS is enabled
+-- version: 1.3.0
+
+USE `SCHub`;
+
+CREATE TABLE IF NOT EXISTS user_counters
+(
+  user_id       INTEGER NOT NULL,
+  projects      INTEGER NOT NULL DEFAULT 0,
+  contributions INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id),
+  FOREIGN KEY (user_id)
+    REFERENCES users (id)
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- seed the counters from the existing rows (the same statement as
+-- UserCounters().reconcile(), run it again if the counters were enabled
+-- before this migration)
+INSERT INTO user_counters (user_id, projects, contributions)
+SELECT users.id,
+       (SELECT COUNT(*) FROM projects WHERE owner = users.id),
+       (SELECT COUNT(*) FROM revisions WHERE contributor_id = users.id)
+FROM users
+ON DUPLICATE KEY UPDATE projects      = VALUES(projects),
+                        contributions = VALUES(contributions);